@@ -1,18 +1,33 @@
-import requests, json, time, sys, os
-from datetime import datetime, timedelta
-from colorama import Fore, init
-from SmartApi import SmartConnect
-import pyotp
-from fastapi import FastAPI, WebSocket
-from fastapi.middleware.cors import CORSMiddleware
-import asyncio, threading, uvicorn
-import pandas as pd
+import json, re, time, sys, os, base64, struct, pickle, random, heapq, itertools, queue, hashlib
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+from bisect import bisect_left
+import colorama
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
-from collections import deque
-from bs4 import BeautifulSoup
+from collections import deque, OrderedDict
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# requests, pandas, SmartApi/pyotp, FastAPI/uvicorn, websocket-client and aiohttp are imported where they are first used -
+# backtests, benchmarks and health probes never pay for the ones they don't touch (`python bench.py --imports`)
 
 load_dotenv()
-init(autoreset=True)
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+class LazyFore:
+    """colorama's Fore - the first colour asked for runs init(autoreset=True), so importers get the reset too"""
+    def __getattr__(self, name):
+        colorama.init(autoreset=True)
+        self.__dict__.update(vars(colorama.Fore))
+        return getattr(colorama.Fore, name)
+
+Fore = LazyFore()
 
 # ==============CONFIGURATION==============# 
 class Config:
@@ -23,6 +38,10 @@ class Config:
     CLIENT_CODE = os.getenv("ANGEL_CLIENT_CODE")
     MPIN = os.getenv("ANGEL_MPIN")
     TOTP_KEY = os.getenv("ANGEL_TOTP_KEY")
+    SESSION_CACHE = os.getenv("SESSION_CACHE", "1") == "1"  # reuse today's tokens across restarts (needs cryptography)
+    SESSION_KEY = os.getenv("SESSION_KEY")  # Fernet key for the token cache - derived from the TOTP secret if unset
+    SESSION_REFRESH_BEFORE = 600  # seconds before JWT expiry the background refresh runs
+    SESSION_RETRY = 60  # seconds between refresh attempts while the broker is unreachable
     
     # Trading Parameters
     STOP_LOSS_AMOUNT = 2500
@@ -35,6 +54,30 @@ class Config:
     
     # Breakout Parameters
     TICK_INTERVAL = 2
+    CANDLE_INTERVAL = 180  # seconds - the breakout candle (3-min)
+    ROLL_BREAKOUT_LEVELS = os.getenv("ROLL_BREAKOUT_LEVELS", "0") == "1"  # opt-in: re-level untraded options every closed candle
+    
+    # Market Data - POLL uses REST LTP calls, STREAM uses the SmartAPI WebSocket feed
+    FEED_MODE = os.getenv("FEED_MODE", "POLL").upper()
+    FEED_URL = os.getenv("FEED_URL", "wss://smartapisocket.angelone.in/smart-stream")
+    FEED_HEARTBEAT = 10
+    FEED_RECONNECT_MAX = 30
+    
+    # Paper trading - simulated fills against the latest cached tick
+    PAPER_LATENCY = float(os.getenv("PAPER_LATENCY", "0.15"))  # seconds from order to first fill
+    PAPER_JITTER = float(os.getenv("PAPER_JITTER", "0.1"))  # random extra latency, up to this many seconds
+    PAPER_SLIPPAGE_BPS = float(os.getenv("PAPER_SLIPPAGE_BPS", "5"))  # adverse slippage on every fill
+    PAPER_FILL_RATIO = float(os.getenv("PAPER_FILL_RATIO", "1"))  # share of the open quantity filled per slice
+    PAPER_FILL_INTERVAL = 0.25  # seconds between partial-fill slices
+    PAPER_QUOTE_TIMEOUT = 5  # seconds an order waits for a first tick before it is rejected
+    
+    # Order execution - orders are placed off the tick loop and confirmed from the order book
+    ORDER_POLL_INTERVAL = 1.0  # seconds between order-book polls while orders are working (orderBook is 1/s)
+    ORDER_VERIFY_TIMEOUT = 15  # seconds an accepted order without an id may go unseen in the book before it is flagged
+    ORDER_WAIT = 10  # seconds shutdown waits for in-flight orders to settle
+    FLATTEN_DEADLINE = 10  # seconds close_all_positions keeps sending / retrying exits
+    FLATTEN_WORKERS = 20  # exit orders in flight at once - matches the placeOrder limit, which still applies
+    FLATTEN_BACKOFF = 0.25  # first retry delay for a failed exit leg, doubling per attempt
     
     # Exit Time
     AUTO_EXIT_TIME = "15:15"
@@ -42,22 +85,388 @@ class Config:
     # Server - FIXED for Render
     WS_HOST = "0.0.0.0"
     WS_PORT = 8080  # Different port from health check server  # Use Render's PORT
+    WS_CLIENT_QUEUE = 8  # pending messages per dashboard client before it gets a fresh snapshot instead
+    WS_SEND_TIMEOUT = 2  # seconds before a stuck dashboard client is dropped
     LOG_TRADES = True
-    LOG_FILE = "trades_log.json"
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_TO_FILE = os.getenv("LOG_TO_FILE", "1") == "1"  # structured JSONL log under DATA_DIR
+    TICK_LOG = os.getenv("TICK_LOG", "FULL").upper()  # FULL: a line per instrument, SUMMARY: one line per tick, OFF
+    TICK_LOG_EVERY = int(os.getenv("TICK_LOG_EVERY", "1"))  # FULL detail on every Nth tick, summary lines between
+    LOG_FILE = "trades_{date}.jsonl"  # trade journal, one per trading day under DATA_DIR
+    JOURNAL_SNAPSHOT = 30  # seconds between open-position PnL snapshots in the journal
+    DATA_DIR = os.getenv("DATA_DIR", "data")
+    RECORD_TICKS = os.getenv("RECORD_TICKS", "1") == "1"
+    
+    # Long build-up scanner
+    NSE_URL = os.getenv("NSE_URL", "https://www.nseindia.com")  # point at a local stand-in for tests
+    SCAN_CACHE_TTL = 60  # seconds an NSE response is reused
+    SCAN_WORKERS = 8  # concurrent NSE requests
+    RESCAN_INTERVAL = int(os.getenv("RESCAN_INTERVAL", "0"))  # seconds between intraday watchlist rotations, 0 = fixed
+    
+    # Startup
+    WATCHLIST_WORKERS = 4
+    
+    # Daemon - one long-lived process serves health/dashboard and runs each day's session
+    DAEMON_START = os.getenv("DAEMON_START", "09:20")  # IST time the session starts on trading days
+    DAEMON_WARMUP = 300  # seconds before DAEMON_START to re-login and refresh the instrument store
+
+def banner():
+    print(f"{Fore.CYAN}{'='*70}\n🤖 LONG BUILD UP TRADING SYSTEM - PARALLEL MONITORING\n{'='*70}")
+    print(f"{Fore.YELLOW}MODE: {Config.MODE} | Stop Loss: ₹{Config.STOP_LOSS_AMOUNT:,} | Max Daily Loss: ₹{Config.MAX_DAILY_LOSS:,}")
+    print(f"Top Stocks: {Config.MAX_STOCKS_TO_TRADE} | Tick Interval: {Config.TICK_INTERVAL}s")
+    print(f"Min Stock Price: ₹{Config.MIN_STOCK_PRICE} | Auto-Exit Time: {Config.AUTO_EXIT_TIME}")
+    print(f"{Fore.CYAN}{'='*70}\n")
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+def _render_watch(r):
+    status = "🔥 ABOVE" if r['ltp'] >= r['breakout'] else "⏳ BELOW"
+    return (Fore.GREEN if r['is_ce'] else Fore.RED) + \
+        f"{r['key']:<15} | LTP: ₹{r['ltp']:7.2f} | Breakout: ₹{r['breakout']:7.2f} | {status}"
+
+def _render_position(r):
+    return (Fore.GREEN if r['is_ce'] else Fore.RED) + \
+        f"{r['key']:<15} | Entry: ₹{r['entry']:7.2f} | LTP: ₹{r['ltp']:7.2f} | " + \
+        (Fore.GREEN if r['pnl'] > 0 else Fore.RED) + f"PnL: ₹{r['pnl']:8,.0f} " + Fore.CYAN + f"| SL: ₹{r['sl']:.2f}"
+
+def _render_tick_summary(r):
+    return Fore.YELLOW + f"⏰ {r['time']} | Watching {r['watching']} ({r['above']} above breakout) | " + \
+        f"Open {r['open']} | " + (Fore.GREEN if r['open_pnl'] >= 0 else Fore.RED) + \
+        f"Open P&L ₹{r['open_pnl']:,.0f} " + Fore.YELLOW + f"| Day ₹{r['day_pnl']:,.0f}"
+
+# kind -> console line. Kinds not listed render as "kind key=value ..."
+RENDERERS = {
+    'tick': lambda r: Fore.CYAN + f"\n{'='*100}\n" + Fore.YELLOW + f"⏰ TICK @ {r['time']}\n" + Fore.CYAN + '='*100,
+    'watch': _render_watch,
+    'positions': lambda r: Fore.CYAN + f"\n{'-'*100}\n" + Fore.YELLOW + "📊 OPEN POSITIONS:\n" + Fore.CYAN + '-'*100,
+    'position': _render_position,
+    'tick_end': lambda r: Fore.CYAN + f"{'='*100}\n",
+    'tick_summary': _render_tick_summary,
+    'trail_on': lambda r: Fore.CYAN + f"   🎯 Trailing Stop Activated @ ₹{r['sl']:.2f}",
+    'trail_up': lambda r: Fore.CYAN + f"   📈 Trailing Stop Updated @ ₹{r['sl']:.2f}",
+    'breakout': lambda r: (Fore.GREEN if r['is_ce'] else Fore.RED) + f"\n🚀 {r['key']} BREAKOUT @ ₹{r['ltp']:.2f} | Time: {r['time']}",
+    'exit': lambda r: (Fore.GREEN if r['is_ce'] else Fore.RED) + f"\n🛑 {r['reason']} - {r['key']} @ ₹{r['ltp']:.2f} | Time: {r['time']}",
+    'exit_pnl': lambda r: (Fore.GREEN if r['is_ce'] else Fore.RED) + f"P&L: ₹{r['pnl']:,.0f} | Daily: ₹{r['day_pnl']:,.0f}",
+    'candle': lambda r: (Fore.GREEN if r['is_ce'] else Fore.RED) +
+        f"🕯️ {r['key']} candle {r['time']} H:{r['high']:.2f} → Breakout: ₹{r['breakout']:.2f}",
+    'order': lambda r: (Fore.RED if r['state'] == 'rejected' else Fore.GREEN) +
+        f"🧾 {r['key']} {r['side']} {r['state'].upper()}" + (f" @ ₹{r['price']:.2f}" if r['price'] else "") +
+        (f" - {r['error']}" if r['error'] else ""),
+    'msg': lambda r: r.get('color', '') + r['text'],
+}
+
+
+class LogPipeline:
+    """Structured logger - callers enqueue compact records, a background thread renders them to console and JSONL"""
+    LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+    # Per-instrument tick detail is console-only - the file gets the one tick_summary record per tick
+    CONSOLE_ONLY = {'tick', 'watch', 'positions', 'position', 'tick_end'}
+    ANSI = re.compile(r'\x1b\[[0-9;]*m')
+    
+    def __init__(self, level="INFO", console=True, directory=None, rate=200):
+        self.level = self.LEVELS.get(level.upper(), 20)
+        self.console = console
+        self.directory = directory
+        self.rate = rate  # console lines per second per kind - the rest are counted, not printed
+        self.suppressed = {}
+        self._window = {}
+        self._pending = deque()  # append/popleft are atomic - no lock on the caller's side
+        self._wake = threading.Event()
+        self._busy = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._day = None
+    
+    def log(self, level, kind, **fields):
+        if self.LEVELS[level] < self.level:
+            return
+        if self._thread is None:
+            self._start()
+        self._pending.append((time.time(), level, kind, fields))
+        if not self._wake.is_set():
+            self._wake.set()
+    
+    def debug(self, kind, **fields):
+        self.log('DEBUG', kind, **fields)
+    
+    def info(self, kind, **fields):
+        self.log('INFO', kind, **fields)
+    
+    def warn(self, kind, **fields):
+        self.log('WARN', kind, **fields)
+    
+    def error(self, kind, **fields):
+        self.log('ERROR', kind, **fields)
+    
+    def message(self, text, color='', level='INFO'):
+        """Free-form line for the rare, non-tick paths"""
+        self.log(level, 'msg', text=text, color=color)
+    
+    def flush(self):
+        """Block until everything queued so far has been rendered - keeps direct prints in order"""
+        if self._thread is not None:
+            self._wake.set()
+            while self._pending or self._busy:
+                time.sleep(0.005)
+    
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        pending = self._pending
+        while True:
+            self._wake.wait()
+            self._busy = True
+            self._wake.clear()
+            batch = []
+            while pending:
+                batch.append(pending.popleft())
+            try:
+                self._write(batch)
+            except Exception as e:
+                sys.__stderr__.write(f"log pipeline error: {e}\n")
+            self._busy = False
+    
+    def _write(self, batch):
+        lines, records = [], []
+        for ts, level, kind, fields in batch:
+            if self.directory and kind not in self.CONSOLE_ONLY:
+                # Colour is a console concern - the file gets the plain text
+                record = {'text': self.ANSI.sub('', fields['text'])} if kind == 'msg' else fields
+                records.append(dumps({'ts': ts, 'level': level, 'kind': kind, **record}))
+            if self.console and self._allow(kind, ts, lines):
+                render = RENDERERS.get(kind)
+                lines.append(render(fields) if render else
+                             f"{kind} " + " ".join(f"{k}={v}" for k, v in fields.items()))
+        
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+        if records:
+            self._open().write("\n".join(records) + "\n")
+            self._file.flush()
+    
+    def _allow(self, kind, ts, lines):
+        """Per-kind console rate limit - drops are reported once the next second starts"""
+        second = int(ts)
+        window = self._window.get(kind)
+        if window is None or window[0] != second:
+            dropped = self.suppressed.pop(kind, 0)
+            if dropped:
+                lines.append(Fore.YELLOW + f"… {dropped} '{kind}' lines suppressed")
+            self._window[kind] = window = [second, 0]
+        window[1] += 1
+        if window[1] > self.rate:
+            self.suppressed[kind] = self.suppressed.get(kind, 0) + 1
+            return False
+        return True
+    
+    def _open(self):
+        day = datetime.now().strftime('%Y%m%d')
+        if self._day != day:  # a long-lived process rolls over to a new file each day
+            if self._file:
+                self._file.close()
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(os.path.join(self.directory, f"log_{day}.jsonl"), 'a')
+            self._day = day
+        return self._file
+
+log = LogPipeline(Config.LOG_LEVEL, directory=Config.DATA_DIR if Config.LOG_TO_FILE else None)
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# Updates are plain += on pre-allocated slots, no lock - under the GIL a rare lost increment between two threads is
+# the price of keeping the tick path free of contention
+class Counter:
+    __slots__ = ('value',)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    """Fixed buckets (upper bounds, inclusive) - observe() is one bisect and two additions"""
+    __slots__ = ('bounds', 'counts', 'sum')
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class MetricFamily:
+    """One metric name - a single series, or one series per value of a label allocated up front"""
+    def __init__(self, name, kind, help, label=None, values=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._le = [repr(float(b)) for b in buckets] + ["+Inf"] if buckets else None
+        self.series = {value: self._new() for value in (values if label else (None,))}
+        self._lock = threading.Lock()
+    
+    def _new(self):
+        return Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+    
+    def labels(self, value):
+        series = self.series.get(value)
+        if series is None:  # a label value nobody declared - allocated once, under the lock
+            with self._lock:
+                series = self.series.setdefault(value, self._new())
+        return series
+    
+    def observe(self, value):
+        self.series[None].observe(value)
+    
+    def inc(self, n=1):
+        self.series[None].inc(n)
+    
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for value, series in list(self.series.items()):
+            label = f'{self.label}="{value}"' if self.label else ''
+            if self.kind == 'counter':
+                lines.append(f"{self.name}{{{label}}} {series.value}" if label else f"{self.name} {series.value}")
+                continue
+            prefix = label + ',' if label else ''
+            total = 0
+            for bound, count in zip(self._le, series.counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {total}')
+            suffix = f"{{{label}}}" if label else ''
+            lines.append(f"{self.name}_sum{suffix} {series.sum}")
+            lines.append(f"{self.name}_count{suffix} {total}")
 
-if not all([Config.API_KEY, Config.CLIENT_CODE, Config.MPIN, Config.TOTP_KEY]):
-    print(Fore.RED + "❌ Missing credentials in .env file!")
-    sys.exit(1)
 
-print(f"{Fore.CYAN}{'='*70}\n🤖 LONG BUILD UP TRADING SYSTEM - PARALLEL MONITORING\n{'='*70}")
-print(f"{Fore.YELLOW}MODE: {Config.MODE} | Stop Loss: ₹{Config.STOP_LOSS_AMOUNT:,} | Max Daily Loss: ₹{Config.MAX_DAILY_LOSS:,}")
-print(f"Top Stocks: {Config.MAX_STOCKS_TO_TRADE} | Tick Interval: {Config.TICK_INTERVAL}s")
-print(f"Min Stock Price: ₹{Config.MIN_STOCK_PRICE} | Auto-Exit Time: {Config.AUTO_EXIT_TIME}")
-print(f"{Fore.CYAN}{'='*70}\n")
+class Metrics:
+    """Process-wide counters and histograms, served in the Prometheus text format on the dashboard's /metrics"""
+    PREFIX = "trader_"
+    ENDPOINTS = ('ltpData', 'quote', 'getCandleData', 'searchScrip', 'placeOrder', 'orderBook')
+    LATENCY = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+    DRIFT = (-1, -0.5, -0.1, -0.01, 0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # seconds vs TICK_INTERVAL
+    
+    def __init__(self):
+        self.families = []
+        self.broker_latency = self._family('broker_call_seconds', 'histogram', "Broker API call latency, retries included",
+                                           'endpoint', self.ENDPOINTS, self.LATENCY)
+        self.process_tick = self._family('process_tick_seconds', 'histogram', "ParallelMonitor.process_tick duration",
+                                         buckets=self.LATENCY)
+        self.tick_to_order = self._family('tick_to_order_seconds', 'histogram',
+                                          "Signal detected on a tick to order acknowledged by the broker",
+                                          'side', ('BUY', 'SELL'), self.LATENCY)
+        self.loop_lag = self._family('event_loop_lag_seconds', 'histogram', "Dashboard server event-loop lag",
+                                     buckets=self.LATENCY)
+        self.broadcast = self._family('broadcast_seconds', 'histogram',
+                                      "Dashboard publish on the server loop - diff, serialize and fan-out to every client", buckets=self.LATENCY)
+        self.tick_drift = self._family('tick_drift_seconds', 'histogram',
+                                       "Time between polling tick starts minus Config.TICK_INTERVAL", buckets=self.DRIFT)
+        self.zero_ltp = self._family('zero_ltp_total', 'counter', "Quotes that came back as 0 (missing or failed)")
+        self.throttled = self._family('broker_throttled_total', 'counter', "Broker calls answered with a rate-limit error",
+                                      'endpoint', self.ENDPOINTS)
+        self.reconnects = self._family('feed_reconnects_total', 'counter', "Market feed reconnects")
+    
+    def _family(self, name, kind, help, label=None, values=(), buckets=None):
+        family = MetricFamily(self.PREFIX + name, kind, help, label, values, buckets)
+        self.families.append(family)
+        return family
+    
+    def render(self):
+        lines = []
+        for family in self.families:
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
 
 # ============WEBSOCKET MANAGER===================# 
+_MISSING = object()
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(obj):
+    """Serialize a dashboard message - orjson when installed, stdlib json otherwise"""
+    if orjson:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=_json_default, separators=(',', ':'))
+
+def copy_state(value):
+    """Copy the dict/list structure of a dashboard state so later in-place edits don't leak into it"""
+    if isinstance(value, dict):
+        return {k: copy_state(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_state(v) for v in value]
+    return value
+
+def diff_state(old, new, path=()):
+    """Changed leaves between two nested dict states - ([path, value] sets, [path] deletes)"""
+    sets, dels = [], []
+    for key, value in new.items():
+        before = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(before, dict):
+            s, d = diff_state(before, value, path + (key,))
+            sets += s
+            dels += d
+        elif before is _MISSING or before != value:
+            sets.append([list(path + (key,)), value])
+    dels += [list(path + (key,)) for key in old if key not in new]
+    return sets, dels
+
+
+class DashboardClient:
+    """One dashboard connection - a bounded queue of pre-serialized messages drained by its own sender task"""
+    def __init__(self, websocket, handler):
+        self.websocket = websocket
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=Config.WS_CLIENT_QUEUE)
+        self.queue.put_nowait(WSManager.SNAPSHOT)
+
+
 class WSManager:
+    SNAPSHOT = None  # queue marker: send the current full state instead of the deltas it replaces
+    
     def __init__(self):
+        self.app = None  # built by start() - importing b never constructs the FastAPI app
+        self.clients = []
+        self.loop = None
+        self.seq = 0
+        self.bytes_per_tick = 0
+        self._snapshot = (None, None)  # (seq, serialized snapshot)
+        self._state = {
+            "trades": {}, 
+            "buildup_stocks": [], 
+            "total_pnl": 0, 
+            "mode": Config.MODE,
+            "live_prices": {},
+            "breakout_status": {}
+        }  # last state published - owned by the server loop
+        self.status = {}  # extra /health fields - the daemon reports its state and start-up timings here
+    
+    def _build_app(self):
+        from fastapi import FastAPI, WebSocket
+        from fastapi.middleware.cors import CORSMiddleware
+        from fastapi.responses import PlainTextResponse
         self.app = FastAPI()
         self.app.add_middleware(
             CORSMiddleware, 
@@ -66,80 +475,292 @@ class WSManager:
             allow_methods=["*"], 
             allow_headers=["*"]
         )
-        self.connections = []
-        self.data = {
-            "trades": {}, 
-            "buildup_stocks": [], 
-            "total_pnl": 0, 
-            "mode": Config.MODE,
-            "live_prices": {},
-            "breakout_status": {}
-        }
         
         @self.app.get("/health")
         async def health_check():
-            return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+            return {"status": "healthy", "timestamp": datetime.now().isoformat(), **self.status}
         
         @self.app.get("/")
         async def root():
             return {"message": "Trading Bot API", "status": "running"}
         
+        @self.app.get("/metrics")
+        async def metrics_endpoint():
+            return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+        
         @self.app.websocket("/ws/trading")
         async def ws_endpoint(ws: WebSocket):
             await ws.accept()
-            self.connections.append(ws)
-            print(f"{Fore.GREEN}✅ Client connected. Total: {len(self.connections)}")
-            await ws.send_json(self.data)
+            self.loop = asyncio.get_running_loop()
+            client = DashboardClient(ws, asyncio.current_task())
+            self.clients.append(client)
+            sender = asyncio.create_task(self._sender(client))
+            print(f"{Fore.GREEN}✅ Client connected. Total: {len(self.clients)}")
             try:
                 while True: 
-                    await ws.receive_text()
+                    # The dashboard asks for a fresh snapshot when it spots a gap in the sequence
+                    if await ws.receive_text() == "resync":
+                        self._resync(client)
             except:
-                if ws in self.connections: 
-                    self.connections.remove(ws)
+                pass
+            finally:
+                sender.cancel()
+                if client in self.clients: 
+                    self.clients.remove(client)
+        return self.app
     
-    def start(self):
+    def start(self, port=None):
+        """Serve on one long-lived event loop in a background thread - publish() hands work to it thread-safely"""
+        import uvicorn
+        self.loop = asyncio.new_event_loop()
+        port = port or Config.WS_PORT
+        server = uvicorn.Server(uvicorn.Config(self.app or self._build_app(), host="0.0.0.0", port=port, log_level="error"))
+        
         def run():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            port = Config.WS_PORT
+            asyncio.set_event_loop(self.loop)
             print(f"{Fore.GREEN}🌐 Starting server on port {port}...")
-            uvicorn.run(self.app, host="0.0.0.0", port=port, log_level="error")
-        threading.Thread(target=run, daemon=True).start()
-        time.sleep(2)
-        print(f"{Fore.GREEN}🌐 WebSocket Server: ws://0.0.0.0:{Config.WS_PORT}/ws/trading")
-    
-    async def broadcast(self, data):
-        for conn in self.connections[:]:
-            try: 
-                await conn.send_json(data)
-            except: 
-                self.connections.remove(conn)
+            self.loop.create_task(self._watch_lag())
+            self.loop.run_until_complete(server.serve())
+        threading.Thread(target=run, name="ws-server", daemon=True).start()
+        
+        deadline = time.time() + 5
+        while not server.started and time.time() < deadline:
+            time.sleep(0.05)
+        print(f"{Fore.GREEN}🌐 WebSocket Server: ws://0.0.0.0:{port}/ws/trading")
+    
+    def publish(self, data):
+        """Hand `data` to the server loop, which diffs, serializes and fans it out - never blocks
+
+        Safe to call from any thread; the caller must not change `data` afterwards. With no dashboard connected it
+        does nothing - a client that connects later gets the last state it saw and the next delta brings it up to date.
+        """
+        if self.loop and self.clients:
+            self.loop.call_soon_threadsafe(self._broadcast, data)
+    
+    def _broadcast(self, state):
+        started = time.perf_counter()
+        sets, dels = diff_state(self._state, state)
+        if not sets and not dels:
+            return
+        self.seq += 1
+        self._state = state
+        message = dumps({"type": "delta", "seq": self.seq, "set": sets, "del": dels})
+        self.bytes_per_tick = len(message)
+        self._fan_out(message)
+        metrics.broadcast.observe(time.perf_counter() - started)
+    
+    async def _watch_lag(self, interval=0.5):
+        """How late the server loop wakes from a fixed sleep - a slow callback on it shows up here"""
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(interval)
+            metrics.loop_lag.observe(max(0, self.loop.time() - started - interval))
+    
+    def _fan_out(self, message):
+        for client in self.clients:
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._resync(client)
+    
+    def _resync(self, client):
+        """Replace everything still queued for a client with one full snapshot"""
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        client.queue.put_nowait(self.SNAPSHOT)
+    
+    def _snapshot_message(self):
+        if self._snapshot[0] != self.seq:
+            self._snapshot = (self.seq, dumps({"type": "snapshot", "seq": self.seq, "data": self._state}))
+        return self._snapshot[1]
+    
+    async def _sender(self, client):
+        try:
+            while True:
+                message = await client.queue.get()
+                if message is self.SNAPSHOT:
+                    message = self._snapshot_message()
+                await asyncio.wait_for(client.websocket.send_text(message), Config.WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Stuck or dead client - drop it so it can't hold anything up
+            print(f"{Fore.YELLOW}⚠️ Dropping dashboard client: {type(e).__name__}")
+            if client in self.clients:
+                self.clients.remove(client)
+            client.handler.cancel()
 
 ws = WSManager()
 
 
 
-# =============== ANGEL ONE CLIENT====================# 
-class AngelClient:
-    SCRIP_URL = 'https://margincalculator.angelone.in/OpenAPI_File/files/OpenAPIScripMaster.json'
-    CACHE_TTL = 3600
+# ============================================================================
+# REQUEST SCHEDULING
+# ============================================================================
+
+# Priority lanes - lower value is served first
+LANE_ORDER, LANE_POSITION, LANE_WATCH, LANE_BACKGROUND = range(4)
+
+
+class ThrottledError(Exception):
+    """Broker kept rejecting a request for exceeding its rate limit"""
+
+
+class RateLimiter:
+    """Token bucket - acquire() blocks until a request slot is free, serving waiters by priority"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
     
-    def __init__(self, api_key, client_code, mpin, totp_key):
-        self.api_key = api_key
+    def acquire(self, priority=LANE_BACKGROUND):
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self._waiters[0] == entry:
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            return
+                        self._cond.wait((1 - self.tokens) / self.rate)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class RequestScheduler:
+    """Single gate for broker calls: per-endpoint token buckets, priority lanes and jittered retry on throttling"""
+    THROTTLE_MARKERS = ('exceeding access rate', 'too many requests', 'rate limit')
+    
+    def __init__(self, limits, max_retries=3, backoff=0.25):
+        self.buckets = {endpoint: RateLimiter(rate) for endpoint, rate in limits.items()}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = {endpoint: {'calls': 0, 'throttled': 0, 'retried': 0, 'dropped': 0, 'errors': 0}
+                      for endpoint in limits}
+    
+    def call(self, endpoint, lane, fn, *args, **kwargs):
+        """Run fn under the endpoint's limit - raises ThrottledError once retries are exhausted"""
+        stats = self.stats[endpoint]
+        for attempt in range(self.max_retries + 1):
+            self.buckets[endpoint].acquire(lane)
+            stats['calls'] += 1
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                if not self._is_throttle(result):
+                    return result
+            except Exception as e:
+                if not self._is_throttle(e):
+                    stats['errors'] += 1
+                    raise
+            finally:
+                metrics.broker_latency.labels(endpoint).observe(time.perf_counter() - started)
+            
+            stats['throttled'] += 1
+            metrics.throttled.labels(endpoint).inc()
+            if attempt == self.max_retries:
+                stats['dropped'] += 1
+                raise ThrottledError(f"{endpoint} throttled after {attempt + 1} attempts")
+            stats['retried'] += 1
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+    
+    def _is_throttle(self, response):
+        if isinstance(response, dict):
+            text = str(response.get('message', '')) if not response.get('status') else ''
+        elif isinstance(response, Exception):
+            text = str(response)
+        else:
+            return False
+        return any(marker in text.lower() for marker in self.THROTTLE_MARKERS)
+    
+    def summary(self):
+        busy = {e: s for e, s in self.stats.items() if s['calls']}
+        return " | ".join(f"{e}: {s['calls']} calls, {s['throttled']} throttled, {s['retried']} retried, "
+                          f"{s['dropped']} dropped, {s['errors']} errors" for e, s in busy.items()) or "no broker calls"
+
+
+# ============================================================================
+# ANGEL ONE SESSION
+# ============================================================================
+
+class AngelSession:
+    """jwt / refresh / feed tokens - cached encrypted on disk, refreshed before expiry, renewed by one caller at a time"""
+    FILE = "session.bin"
+    REJECTED = ('AG8001', 'AG8002', 'AG8003')  # invalid / expired / missing token
+    
+    def __init__(self, smart_api, client_code, mpin, totp_key, directory=Config.DATA_DIR, key=Config.SESSION_KEY,
+                 cache=Config.SESSION_CACHE, refresh_before=Config.SESSION_REFRESH_BEFORE):
+        self.smart_api = smart_api
         self.client_code = client_code
         self.mpin = mpin
         self.totp_key = totp_key
-        self.smart_api = SmartConnect(api_key=api_key)
-        self.auth_token = None
-        self._scrip_cache = None
-        self._cache_time = None
+        self.path = os.path.join(directory, self.FILE) if cache and directory else None
+        self.key = key
+        self.refresh_before = refresh_before
+        self.jwt = None
+        self.refresh_token = None
+        self.feed_token = None
+        self.expires = 0
+        self.logins = 0
+        self.refreshes = 0
+        self._cipher = None
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._thread = None
     
-    def login(self):
+    def ensure(self):
+        """A usable session - cached tokens while they are good, else a refresh, else a TOTP login"""
+        with self._lock:
+            if not self.jwt:
+                cached = self._load()
+                if cached:
+                    self._set(cached['jwt'], cached['refresh'], cached['feed'], cached['expires'], save=False)
+                    if self._fresh():
+                        print(f"{Fore.GREEN}✅ Reusing cached Angel One session "
+                              f"(valid until {datetime.fromtimestamp(self.expires, IST).strftime('%H:%M')})")
+            ok = self._fresh() or self._refresh() or self._login()
+        if ok and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-refresh", daemon=True)
+            self._thread.start()
+        return ok
+    
+    def renew(self, stale):
+        """Replace a token the broker rejected - callers holding the same stale token share one renewal"""
+        with self._lock:
+            if self.jwt != stale:
+                return True
+            return self._refresh() or self._login()
+    
+    def rejected(self, response):
+        """True when a broker response or exception says the token is no longer valid"""
+        if isinstance(response, dict):
+            return str(response.get('errorcode') or response.get('errorCode') or '') in self.REJECTED
+        return type(response).__name__ == 'TokenException'
+    
+    def _fresh(self):
+        return bool(self.jwt) and self.expires - time.time() > self.refresh_before
+    
+    def _login(self):
         try:
+            import pyotp
             totp = pyotp.TOTP(self.totp_key).now()
             data = self.smart_api.generateSession(self.client_code, self.mpin, totp)
             if data.get('status'):
-                self.auth_token = data['data']['jwtToken']
+                self._set(self.smart_api.access_token, self.smart_api.refresh_token,
+                          data['data'].get('feedToken') or self.smart_api.getfeedToken())
+                self.logins += 1
                 print(f"{Fore.GREEN}✅ Logged in to Angel One")
                 return True
             print(f"{Fore.RED}❌ Login failed: {data.get('message', 'Unknown error')}")
@@ -148,108 +769,310 @@ class AngelClient:
             print(f"{Fore.RED}❌ Login failed: {e}")
             return False
     
-    def get_ltp(self, exchange, symbol, token):
+    def _refresh(self):
+        """New jwt / feed token from the refresh token - no TOTP round, False if the broker refuses it"""
+        if not self.refresh_token:
+            return False
+        try:
+            data = self.smart_api.generateToken(self.refresh_token)
+            if not data.get('status'):
+                return False
+            self._set(data['data']['jwtToken'], data['data'].get('refreshToken') or self.refresh_token,
+                      data['data'].get('feedToken') or self.feed_token)
+            self.refreshes += 1
+            log.message(f"🔄 Angel One session refreshed "
+                        f"(valid until {datetime.fromtimestamp(self.expires, IST).strftime('%H:%M')})", Fore.GREEN)
+            return True
+        except Exception as e:
+            log.message(f"⚠️ Session refresh failed: {e}", Fore.YELLOW, level='WARN')
+            return False
+    
+    def _set(self, jwt, refresh, feed, expires=None, save=True):
+        jwt = jwt[len('Bearer '):] if jwt.startswith('Bearer ') else jwt
+        self.jwt, self.refresh_token, self.feed_token = jwt, refresh, feed
+        self.expires = expires or self.expiry(jwt)
+        self.smart_api.setAccessToken(jwt)
+        self.smart_api.setRefreshToken(refresh)
+        self.smart_api.setFeedToken(feed)
+        self.smart_api.setUserId(self.client_code)
+        if save:
+            self._save()
+        self._changed.set()
+    
+    @staticmethod
+    def expiry(jwt):
+        """The JWT's `exp` claim (read, not verified - it only schedules the refresh), else the end of the IST day"""
+        try:
+            payload = jwt.split('.')[1]
+            return float(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+        except Exception:
+            now = datetime.now(IST)
+            return (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+    
+    def _run(self):
+        """Refresh REFRESH_BEFORE ahead of expiry - the wait restarts whenever the tokens change"""
+        while True:
+            self._changed.clear()
+            if self._changed.wait(max(0, self.expires - self.refresh_before - time.time())):
+                continue
+            if not self.renew(self.jwt):
+                self._changed.wait(Config.SESSION_RETRY)
+    
+    def _fernet(self):
+        if self._cipher is None:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                print(Fore.YELLOW + "⚠️ Session cache disabled - pip install cryptography")
+                self.path = None
+                return None
+            key = self.key or base64.urlsafe_b64encode(
+                hashlib.pbkdf2_hmac('sha256', self.totp_key.encode(), self.client_code.encode(), 100000))
+            self._cipher = Fernet(key)
+        return self._cipher
+    
+    def _load(self):
+        """Cached tokens for this client, None if there are none, they are unreadable or they belong to someone else"""
+        if not self.path or not os.path.exists(self.path) or not self._fernet():
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                cached = json.loads(self._cipher.decrypt(f.read()))
+        except Exception as e:
+            print(Fore.YELLOW + f"⚠️ Ignoring session cache: {type(e).__name__}")
+            return None
+        return cached if cached.get('client') == self.client_code and cached.get('expires', 0) > time.time() else None
+    
+    def _save(self):
+        if not self.path or not self._fernet():
+            return
+        token = self._cipher.encrypt(dumps({'client': self.client_code, 'jwt': self.jwt, 'refresh': self.refresh_token,
+                                            'feed': self.feed_token, 'expires': self.expires}).encode())
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(token)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(Fore.YELLOW + f"⚠️ Could not save session cache: {e}")
+
+
+# =============== ANGEL ONE CLIENT====================# 
+class AngelClient:
+    SCRIP_URL = 'https://margincalculator.angelone.in/OpenAPI_File/files/OpenAPIScripMaster.json'
+    QUOTE_CHUNK = 50  # max tokens per market-data quote request
+    QUOTE_WORKERS = 4
+    CANDLE_LOOKBACK = 15  # minutes of ONE_MINUTE bars fetched to build the breakout candle
+    # Angel One per-second API limits
+    RATE_LIMITS = {'ltpData': 10, 'quote': 10, 'getCandleData': 3, 'searchScrip': 1, 'placeOrder': 20, 'orderBook': 1}
+    LOG_ERROR_EVERY = 60  # seconds between repeated broker-error prints per endpoint
+    
+    def __init__(self, api_key, client_code, mpin, totp_key):
+        self.api_key = api_key
+        self.client_code = client_code
+        self.mpin = mpin
+        self.totp_key = totp_key
+        from SmartApi import SmartConnect
+        self.smart_api = SmartConnect(api_key=api_key)
+        self.session = AngelSession(self.smart_api, client_code, mpin, totp_key)
+        self.session_day = None  # IST date of the last successful login - the JWT does not outlive the day
+        self.instruments = InstrumentStore(self.SCRIP_URL, Config.DATA_DIR)
+        self.candle_cache = CandleCache(os.path.join(Config.DATA_DIR, "candles"))
+        self.scheduler = RequestScheduler(self.RATE_LIMITS)
+        self.prices = PriceTable()  # latest quote per token - shared by the feed, REST quotes and the paper exchange
+        self.paper = PaperExchange(self.prices)
+        self._error_logged = {}
+        self._quote_pool = ThreadPoolExecutor(max_workers=self.QUOTE_WORKERS, thread_name_prefix="quote")
+        self._inflight = {}
+        self._inflight_lock = threading.RLock()
+        self.recorder = TickRecorder(os.path.join(Config.DATA_DIR, "ticks")) if Config.RECORD_TICKS else None
+    
+    def login(self):
+        """Cached, refreshed or fresh TOTP session - see AngelSession"""
+        if not self.session.ensure():
+            return False
+        self.session_day = SystemClock().now().date()
+        return True
+    
+    @property
+    def auth_token(self):
+        return f"Bearer {self.session.jwt}" if self.session.jwt else None
+    
+    @property
+    def feed_token(self):
+        return self.session.feed_token
+    
+    def new_session(self):
+        """Reset per-session state so a long-lived client can run another day - the login, pools and caches stay warm"""
+        self.paper.reset()
+        if self.recorder and self.recorder.closed:
+            self.recorder = TickRecorder(os.path.join(Config.DATA_DIR, "ticks"))
+    
+    def _call(self, endpoint, lane, fn, *args):
+        """Route one SmartConnect call through the request scheduler - a rejected token is renewed and the call retried once"""
+        stale = self.session.jwt
         try:
-            data = self.smart_api.ltpData(exchange, symbol, token)
-            return float(data.get('data', {}).get('ltp', 0)) if data.get('status') else 0
-        except: return 0
+            result = self.scheduler.call(endpoint, lane, fn, *args)
+        except Exception as e:
+            if not self.session.rejected(e) or not self.session.renew(stale):
+                raise
+            return self.scheduler.call(endpoint, lane, fn, *args)
+        if self.session.rejected(result) and self.session.renew(stale):
+            return self.scheduler.call(endpoint, lane, fn, *args)
+        return result
+    
+    def _log_error(self, endpoint, error):
+        """Print a broker failure, at most once per LOG_ERROR_EVERY per endpoint"""
+        now = time.time()
+        if now - self._error_logged.get(endpoint, 0) >= self.LOG_ERROR_EVERY:
+            self._error_logged[endpoint] = now
+            log.message(f"❌ {endpoint} failed: {error}", Fore.RED, level='ERROR')
+    
+    def get_ltp(self, exchange, symbol, token, lane=LANE_WATCH):
+        try:
+            data = self._call('ltpData', lane, self.smart_api.ltpData, exchange, symbol, token)
+            ltp = float(data.get('data', {}).get('ltp', 0)) if data.get('status') else 0
+        except Exception as e:
+            self._log_error('ltpData', e)
+            ltp = 0
+        if not ltp:
+            metrics.zero_ltp.inc()
+        return ltp
     
     def get_ltp_batch(self, instruments):
-        """Get LTP for multiple instruments at once"""
+        """Get LTP for multiple instruments at once - one bulk quote call per exchange chunk"""
+        # Open positions go in their own chunks on the higher-priority lane
+        groups = {}
+        for inst in instruments:
+            lane = LANE_POSITION if inst.get('is_trade') else LANE_WATCH
+            groups.setdefault((lane, inst['exchange']), set()).add(str(inst['token']))
+        
+        futures = {}
+        for (lane, exchange), tokens in sorted(groups.items()):
+            futures.update(self._quote_futures(exchange, tokens, lane))
+        
         prices = {}
         for inst in instruments:
-            ltp = self.get_ltp(inst['exchange'], inst['symbol'], inst['token'])
-            prices[inst['key']] = ltp
+            token = str(inst['token'])
+            try:
+                prices[inst['key']] = futures[(inst['exchange'], token)].result().get(token, 0)
+            except Exception as e:
+                self._log_error('quote', e)
+                prices[inst['key']] = 0
+        metrics.zero_ltp.inc(sum(1 for ltp in prices.values() if not ltp))
         return prices
     
+    def _quote_futures(self, exchange, tokens, lane=LANE_WATCH):
+        """Map (exchange, token) to a quote future, joining requests already in flight"""
+        with self._inflight_lock:
+            futures = {(exchange, t): self._inflight[(exchange, t)] for t in tokens if (exchange, t) in self._inflight}
+            missing = sorted(t for t in tokens if (exchange, t) not in futures)
+            
+            for i in range(0, len(missing), self.QUOTE_CHUNK):
+                chunk = missing[i:i + self.QUOTE_CHUNK]
+                future = self._quote_pool.submit(self._fetch_quotes, exchange, chunk, lane)
+                for token in chunk:
+                    futures[(exchange, token)] = self._inflight[(exchange, token)] = future
+                future.add_done_callback(lambda f, ex=exchange, ch=chunk: self._release_quotes(ex, ch, f))
+        return futures
+    
+    def _release_quotes(self, exchange, tokens, future):
+        with self._inflight_lock:
+            for token in tokens:
+                if self._inflight.get((exchange, token)) is future:
+                    del self._inflight[(exchange, token)]
+    
+    def _fetch_quotes(self, exchange, tokens, lane=LANE_WATCH):
+        """One bulk LTP quote request - returns {token: ltp}"""
+        data = self._call('quote', lane, self.smart_api.getMarketData, "LTP", {exchange: tokens})
+        if not data.get('status'):
+            raise Exception(data.get('message', 'Quote request failed'))
+        quotes = {str(q['symbolToken']): float(q.get('ltp', 0)) for q in (data.get('data') or {}).get('fetched', [])}
+        self.prices.update_many(quotes)
+        if self.recorder:
+            self.recorder.record_many(quotes)
+        return quotes
+    
+    def feed_headers(self):
+        """Feed handshake headers - read per connect, so a reconnect after a session refresh sends the new tokens"""
+        return {
+            "Authorization": self.auth_token,
+            "x-api-key": self.api_key,
+            "x-client-code": self.client_code,
+            "x-feed-token": self.feed_token
+        }
+    
+    def start_feed(self):
+        """Open the streaming market-data feed for this session"""
+        return MarketFeed(Config.FEED_URL, self.feed_headers, prices=self.prices, recorder=self.recorder).start()
+    
     def _load_scrip_master(self, force_refresh=False):
-        if not force_refresh and self._scrip_cache is not None and self._cache_time:
-            if time.time() - self._cache_time < self.CACHE_TTL:
-                return self._scrip_cache
-        
         try:
-            print(f"{Fore.CYAN}📥 Downloading ScripMaster...")
-            response = requests.get(self.SCRIP_URL, timeout=15)
-            response.raise_for_status()
-            self._scrip_cache = pd.DataFrame(response.json())
-            self._cache_time = time.time()
-            print(f"{Fore.GREEN}✓ ScripMaster loaded: {len(self._scrip_cache):,} instruments")
-            return self._scrip_cache
+            return self.instruments.load(force_refresh)
         except Exception as e:
             print(f"{Fore.RED}❌ ScripMaster download failed: {e}")
             return None
     
     def get_lot_size(self, symbol):
         try:
-            df = self._load_scrip_master()
-            if df is None: return None
-            
-            fno = df[(df['name'] == symbol) & (df['exch_seg'] == 'NFO') & 
-                     (df['instrumenttype'].isin(['FUTSTK', 'OPTSTK']))]
+            store = self._load_scrip_master()
+            if store is None: return None
             
-            if fno.empty:
-                print(f"{Fore.YELLOW}⚠️ {symbol}: Not in F&O")
+            lot_size = store.lot_size(symbol)
+            if not lot_size:
+                log.message(f"⚠️ {symbol}: Not in F&O", Fore.YELLOW)
                 return None
             
-            lot_size = int(fno.iloc[0]['lotsize'])
-            print(f"{Fore.GREEN}✓ {symbol} Lot Size: {lot_size:,}")
+            log.message(f"✓ {symbol} Lot Size: {lot_size:,}", Fore.GREEN)
             return lot_size
         except Exception as e:
-            print(f"{Fore.RED}❌ Error fetching lot size for {symbol}: {e}")
+            log.message(f"❌ Error fetching lot size for {symbol}: {e}", Fore.RED, level='ERROR')
             return None
     
     def search(self, exchange, text):
         try:
-            data = self.smart_api.searchScrip(exchange, text)
+            data = self._call('searchScrip', LANE_BACKGROUND, self.smart_api.searchScrip, exchange, text)
             return data.get('data', []) if data.get('status') else []
-        except: return []
+        except Exception as e:
+            self._log_error('searchScrip', e)
+            return []
     
     def get_candle_data(self, exchange, symbol, token, interval="THREE_MINUTE"):
-        try:
-            return self._fetch_candles(exchange, token, interval, 15, 2) or \
-                   self._fetch_aggregated_candles(exchange, token)
-        except:
-            return self._fetch_aggregated_candles(exchange, token)
+        """Last completed candle of `interval`, built locally from one ONE_MINUTE fetch"""
+        return self._last_candle(token, self._fetch_minute_candles(exchange, token), interval)
     
-    def _fetch_candles(self, exchange, token, interval, lookback_mins, min_candles):
-        try:
-            from_date = (datetime.now() - timedelta(minutes=lookback_mins)).strftime("%Y-%m-%d %H:%M")
-            to_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-            
-            data = self.smart_api.getCandleData({
-                "exchange": exchange, "symboltoken": token, "interval": interval,
-                "fromdate": from_date, "todate": to_date
-            })
-            
-            if data.get('status') and data.get('data') and len(data['data']) >= min_candles:
-                candle = data['data'][-2]
-                return self._parse_candle(candle)
-            return None
-        except: return None
+    def _fetch_minute_candles(self, exchange, token, lookback_mins=CANDLE_LOOKBACK):
+        """ONE_MINUTE bars for the lookback window - only the tail after the last cached bar is requested"""
+        end = time.time()
+        start = end - lookback_mins * 60
+        since = self.candle_cache.missing_since(token, "ONE_MINUTE", start, end)
+        if since is not None:
+            try:
+                data = self._call('getCandleData', LANE_BACKGROUND, self.smart_api.getCandleData, {
+                    "exchange": exchange, "symboltoken": token, "interval": "ONE_MINUTE",
+                    "fromdate": datetime.fromtimestamp(since, IST).strftime("%Y-%m-%d %H:%M"),
+                    "todate": datetime.fromtimestamp(end, IST).strftime("%Y-%m-%d %H:%M")
+                })
+                if not data.get('status'):
+                    return None
+                self.candle_cache.add(token, "ONE_MINUTE", data.get('data') or [], since, end)
+            except Exception as e:
+                self._log_error('getCandleData', e)
+                return None
+        return self.candle_cache.range(token, "ONE_MINUTE", start, end)
     
-    def _fetch_aggregated_candles(self, exchange, token):
-        try:
-            from_date = (datetime.now() - timedelta(minutes=10)).strftime("%Y-%m-%d %H:%M")
-            to_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-            
-            data = self.smart_api.getCandleData({
-                "exchange": exchange, "symboltoken": token, "interval": "ONE_MINUTE",
-                "fromdate": from_date, "todate": to_date
-            })
-            
-            if data.get('status') and data.get('data') and len(data['data']) >= 3:
-                candles = data['data'][-4:-1]
-                return {
-                    'open': float(candles[0][1]),
-                    'high': max(float(c[2]) for c in candles),
-                    'low': min(float(c[3]) for c in candles),
-                    'close': float(candles[-1][4]),
-                    'volume': sum(int(c[5]) if len(c) > 5 else 0 for c in candles),
-                    'timestamp': self._parse_timestamp(candles[-1][0]).strftime('%H:%M:%S'),
-                    'candle_time': self._parse_timestamp(candles[-1][0])
-                }
+    def _last_candle(self, token, bars, interval):
+        """Aggregate cached ONE_MINUTE bars to `interval` - the completed candle plus the bars to seed a CandleBuilder"""
+        if bars is None or not len(bars):
             return None
-        except: return None
+        bars = bars.tolist()
+        seconds = CandleBuilder.INTERVALS[interval]
+        builder = CandleBuilder((seconds,))
+        builder.seed(token, bars)
+        builder.flush(time.time())
+        candle = builder.last(token, seconds)
+        return dict(candle, bars=bars) if candle else None
     
     def _parse_candle(self, candle):
         return {
@@ -268,25 +1091,17 @@ class AngelClient:
             return datetime.fromisoformat(ts_str.replace('+05:30', ''))
         return datetime.strptime(ts_str, "%Y-%m-%d %H:%M:%S")
     
-    def place_order(self, symbol, token, transaction_type, quantity, order_type="MARKET", price=0):
-        return (self._place_paper_order(symbol, token, transaction_type, quantity, price) 
+    def place_order(self, symbol, token, transaction_type, quantity, order_type="MARKET", price=0, tag=None):
+        return (self.paper.submit(symbol, token, transaction_type, quantity, order_type, price, tag, self._token_lot(token))
                 if Config.MODE == "PAPER" 
-                else self._place_live_order(symbol, token, transaction_type, quantity, order_type, price))
+                else self._place_live_order(symbol, token, transaction_type, quantity, order_type, price, tag))
 
-    def _place_paper_order(self, symbol, token, transaction_type, quantity, price):
-        import random
-        order_id = f"PAPER_{int(time.time())}_{random.randint(1000, 9999)}"
-        ltp = self.get_ltp("NFO", symbol, token)
-        execution_price = ltp if ltp > 0 else price
-        
-        print(Fore.CYAN + f"📄 PAPER: {transaction_type} {quantity} {symbol} @ ₹{execution_price:.2f} | ID: {order_id}")
-        time.sleep(0.5)
-        
-        return {'success': True, 'orderid': order_id, 'data': {
-            'orderid': order_id, 'mode': 'PAPER', 'price': execution_price, 
-            'quantity': quantity, 'symbol': symbol}}
+    def _token_lot(self, token):
+        """Contract lot size for a token from the instrument store - 1 when it isn't loaded or doesn't know the token"""
+        row = self.instruments.by_token(token) if len(self.instruments) and str(token).isdigit() else None
+        return row['lotsize'] if row and row['lotsize'] > 0 else 1
 
-    def _place_live_order(self, symbol, token, transaction_type, quantity, order_type, price):
+    def _place_live_order(self, symbol, token, transaction_type, quantity, order_type, price, tag=None):
         try:
             order_params = {
                 "variety": "NORMAL", "tradingsymbol": symbol, "symboltoken": str(token),
@@ -295,46 +1110,52 @@ class AngelClient:
                 "price": str(price) if order_type == "LIMIT" else "0",
                 "squareoff": "0", "stoploss": "0", "quantity": str(quantity)
             }
+            if tag:
+                order_params["ordertag"] = tag
             
-            print(Fore.CYAN + f"📤 {transaction_type}: {quantity} {symbol}")
-            response = self.smart_api.placeOrder(order_params)
-            
-            if isinstance(response, str):
-                print(Fore.GREEN + f"✅ ORDER: {response}")
-                return {'success': True, 'orderid': response, 'data': {'orderid': response}}
+            log.message(f"📤 {transaction_type}: {quantity} {symbol}", Fore.CYAN)
+            # placeOrder only returns the order id (None on any failure) - the full reply keeps the broker's status,
+            # errorcode and message, so an expired token reaches session.rejected and a rate limit the scheduler
+            response = self._call('placeOrder', LANE_ORDER, self.smart_api.placeOrderFullResponse, order_params)
             
             if isinstance(response, dict):
                 if response.get('status') in [True, 'true']:
-                    order_id = (response.get('data', {}).get('orderid') or 
+                    order_id = ((response.get('data') or {}).get('orderid') or 
                                response.get('orderid') or 
                                response.get('uniqueorderid'))
                     
                     if order_id:
-                        print(Fore.GREEN + f"✅ ORDER: {order_id}")
+                        log.message(f"✅ ORDER: {order_id}", Fore.GREEN)
                         return {'success': True, 'orderid': str(order_id), 'data': response.get('data', response)}
                     
                     return {'success': True, 'orderid': 'PENDING_VERIFICATION', 'data': response}
                 
                 error_msg = response.get('message') or response.get('error') or str(response)
-                print(Fore.RED + f"❌ FAILED: {error_msg}")
+                if response.get('errorcode'):
+                    error_msg = f"{error_msg} ({response['errorcode']})"
+                log.message(f"❌ FAILED: {error_msg}", Fore.RED, level='ERROR')
                 return {'success': False, 'error': error_msg}
             
-            return {'success': False, 'error': f'Unexpected type: {type(response)}'}
+            # No reply we can read - the order may still have been taken, the order book decides
+            return {'success': False, 'error': f'Unexpected type: {type(response)}', 'unconfirmed': True}
                 
         except Exception as e:
-            print(Fore.RED + f"❌ Exception: {e}")
-            return {'success': False, 'error': str(e)}
+            log.message(f"❌ Exception: {e}", Fore.RED, level='ERROR')
+            # Anything but a throttle may have failed after the broker took the order - not a rejection
+            return {'success': False, 'error': str(e), 'unconfirmed': not isinstance(e, ThrottledError)}
 
-    def get_order_book(self):
+    def fetch_order_book(self):
+        """Today's orders without printing - what the order worker polls"""
         if Config.MODE == "PAPER":
+            return self.paper.order_book()
+        response = self._call('orderBook', LANE_ORDER, self.smart_api.orderBook)
+        if not (isinstance(response, dict) and response.get('status')):
             return []
-        
+        return response.get('data') or []
+    
+    def get_order_book(self):
         try:
-            response = self.smart_api.orderBook()
-            if not (isinstance(response, dict) and response.get('status')):
-                return []
-            
-            orders = response.get('data', [])
+            orders = self.fetch_order_book()
             if orders:
                 print(Fore.CYAN + f"\n{'='*70}\n📋 ORDER BOOK ({len(orders)} orders)\n{'='*70}")
                 for order in orders[-5:]:
@@ -348,74 +1169,1087 @@ class AngelClient:
             return []
 
 # ============================================================================
-# LONG BUILD UP SCANNER
+# ASYNC ANGEL ONE CLIENT
 # ============================================================================
 
-def fetch_long_buildup_from_nse():
-    """
-    Fetch REAL Long Build Up stocks from NSE using FnO data
-    Long Build Up = Price UP + OI UP (Bullish signal)
-    FILTERS STOCKS WITH LTP > Config.MIN_STOCK_PRICE
-    """
-    print(Fore.CYAN + f"\n{'='*70}\n🔍 FETCHING REAL LONG BUILD UP STOCKS FROM NSE\n{'='*70}\n")
-    print(Fore.YELLOW + f"📊 Filtering stocks with LTP > ₹{Config.MIN_STOCK_PRICE}\n")
+class AsyncRequestScheduler:
+    """Coroutine front of a RequestScheduler - the same token buckets, lanes, retry policy and stats, so sync and
+    async callers share one rate budget per endpoint"""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.stats = scheduler.stats
     
-    buildup_stocks = []
+    async def call(self, endpoint, lane, fn, *args, **kwargs):
+        scheduler = self.scheduler
+        stats = self.stats[endpoint]
+        for attempt in range(scheduler.max_retries + 1):
+            # The bucket blocks - wait on it from a worker thread so the event loop keeps running
+            await asyncio.to_thread(scheduler.buckets[endpoint].acquire, lane)
+            stats['calls'] += 1
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+                if not scheduler._is_throttle(result):
+                    return result
+            except Exception as e:
+                if not scheduler._is_throttle(e):
+                    stats['errors'] += 1
+                    raise
+            finally:
+                metrics.broker_latency.labels(endpoint).observe(time.perf_counter() - started)
+            
+            stats['throttled'] += 1
+            metrics.throttled.labels(endpoint).inc()
+            if attempt == scheduler.max_retries:
+                stats['dropped'] += 1
+                raise ThrottledError(f"{endpoint} throttled after {attempt + 1} attempts")
+            stats['retried'] += 1
+            await asyncio.sleep(scheduler.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+class AsyncAngelClient:
+    """asyncio front of an AngelClient - its session, rate budgets, caches and paper exchange, calls over pooled HTTP"""
+    ROOT = "https://apiconnect.angelone.in"
+    ROUTES = {
+        'ltpData': "/rest/secure/angelbroking/order/v1/getLtpData",
+        'quote': "/rest/secure/angelbroking/market/v1/quote",
+        'getCandleData': "/rest/secure/angelbroking/historical/v1/getCandleData",
+        'searchScrip': "/rest/secure/angelbroking/order/v1/searchScrip",
+        'placeOrder': "/rest/secure/angelbroking/order/v1/placeOrder",
+        'orderBook': "/rest/secure/angelbroking/order/v1/getOrderBook"
+    }
+    POOL_SIZE = 16  # concurrent connections to the broker, kept alive between calls
+    LOG_ERROR_EVERY = AngelClient.LOG_ERROR_EVERY
     
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': 'https://www.nseindia.com/',
-        }
-        
-        session = requests.Session()
-        session.headers.update(headers)
+    _log_error = AngelClient._log_error
+    
+    def __init__(self, client):
+        self.client = client
+        self.session = client.session
+        self.scheduler = AsyncRequestScheduler(client.scheduler)
+        self.candle_cache = client.candle_cache
+        self.prices = client.prices
+        self.paper = client.paper
+        self._error_logged = {}
+        self._http_session = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.close()
+    
+    @property
+    def recorder(self):
+        return self.client.recorder  # new_session() may replace it
+    
+    def _http(self):
+        if self._http_session is None or self._http_session.closed:
+            try:
+                import aiohttp
+            except ImportError:
+                raise ImportError("AsyncAngelClient needs aiohttp - pip install aiohttp")
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.POOL_SIZE, limit_per_host=self.POOL_SIZE,
+                                               keepalive_timeout=60, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10),
+                headers={
+                    "Content-type": "application/json",
+                    "Accept": "application/json",
+                    "X-UserType": "USER",
+                    "X-SourceID": "WEB",
+                    "X-ClientLocalIP": "127.0.0.1",
+                    "X-ClientPublicIP": "127.0.0.1",
+                    "X-MACAddress": "00:00:00:00:00:00",
+                    "X-PrivateKey": self.client.api_key
+                })
+        return self._http_session
+    
+    async def close(self):
+        if self._http_session and not self._http_session.closed:
+            await self._http_session.close()
+    
+    async def login(self):
+        """The shared AngelSession's login - cached, refreshed or TOTP, run off the loop"""
+        return await asyncio.to_thread(self.client.login)
+    
+    async def _request(self, route, payload=None, method="POST"):
+        # The jwt is read per request, so a background refresh applies to the very next call
+        headers = {"Authorization": self.client.auth_token} if self.session.jwt else None
+        async with self._http().request(method, self.ROOT + self.ROUTES[route], json=payload, headers=headers) as r:
+            return await r.json(content_type=None)
+    
+    async def _call(self, endpoint, lane, payload=None, method="POST"):
+        """One REST call under the shared limits - a rejected token is renewed and the call retried once"""
+        stale = self.session.jwt
+        result = await self.scheduler.call(endpoint, lane, self._request, endpoint, payload, method)
+        if self.session.rejected(result) and await asyncio.to_thread(self.session.renew, stale):
+            return await self.scheduler.call(endpoint, lane, self._request, endpoint, payload, method)
+        return result
+    
+    async def get_ltp(self, exchange, symbol, token, lane=LANE_WATCH):
+        try:
+            data = await self._call('ltpData', lane, {"exchange": exchange, "tradingsymbol": symbol, "symboltoken": token})
+            ltp = float(data.get('data', {}).get('ltp', 0)) if data.get('status') else 0
+        except Exception as e:
+            self._log_error('ltpData', e)
+            ltp = 0
+        if not ltp:
+            metrics.zero_ltp.inc()
+        return ltp
+    
+    async def get_ltp_batch(self, instruments):
+        """Get LTP for multiple instruments - every quote chunk is in flight at once"""
+        groups = {}
+        for inst in instruments:
+            lane = LANE_POSITION if inst.get('is_trade') else LANE_WATCH
+            groups.setdefault((lane, inst['exchange']), set()).add(str(inst['token']))
+        
+        chunks = []
+        for (lane, exchange), tokens in sorted(groups.items()):
+            tokens = sorted(tokens)
+            for i in range(0, len(tokens), AngelClient.QUOTE_CHUNK):
+                chunks.append((exchange, tokens[i:i + AngelClient.QUOTE_CHUNK], lane))
+        
+        quotes = {}
+        results = await asyncio.gather(*(self._fetch_quotes(*c) for c in chunks), return_exceptions=True)
+        for (exchange, _, _), result in zip(chunks, results):
+            if isinstance(result, Exception):
+                self._log_error('quote', result)
+                continue
+            quotes.update({(exchange, token): ltp for token, ltp in result.items()})
+        prices = {inst['key']: quotes.get((inst['exchange'], str(inst['token'])), 0) for inst in instruments}
+        metrics.zero_ltp.inc(sum(1 for ltp in prices.values() if not ltp))
+        return prices
+    
+    async def _fetch_quotes(self, exchange, tokens, lane=LANE_WATCH):
+        data = await self._call('quote', lane, {"mode": "LTP", "exchangeTokens": {exchange: tokens}})
+        if not data.get('status'):
+            raise Exception(data.get('message', 'Quote request failed'))
+        quotes = {str(q['symbolToken']): float(q.get('ltp', 0)) for q in (data.get('data') or {}).get('fetched', [])}
+        self.prices.update_many(quotes)
+        if self.recorder:
+            self.recorder.record_many(quotes)
+        return quotes
+    
+    async def search(self, exchange, text):
+        try:
+            data = await self._call('searchScrip', LANE_BACKGROUND, {"exchange": exchange, "searchscrip": text})
+            return data.get('data', []) if data.get('status') else []
+        except Exception as e:
+            self._log_error('searchScrip', e)
+            return []
+    
+    async def get_candle_data(self, exchange, symbol, token, interval="THREE_MINUTE"):
+        return self.client._last_candle(token, await self._fetch_minute_candles(exchange, token), interval)
+    
+    async def _fetch_minute_candles(self, exchange, token, lookback_mins=AngelClient.CANDLE_LOOKBACK):
+        """ONE_MINUTE bars from the shared CandleCache - only the tail after the last cached bar is requested"""
+        end = time.time()
+        start = end - lookback_mins * 60
+        since = self.candle_cache.missing_since(token, "ONE_MINUTE", start, end)
+        if since is not None:
+            try:
+                data = await self._call('getCandleData', LANE_BACKGROUND, {
+                    "exchange": exchange, "symboltoken": token, "interval": "ONE_MINUTE",
+                    "fromdate": datetime.fromtimestamp(since, IST).strftime("%Y-%m-%d %H:%M"),
+                    "todate": datetime.fromtimestamp(end, IST).strftime("%Y-%m-%d %H:%M")
+                })
+                if not data.get('status'):
+                    return None
+                self.candle_cache.add(token, "ONE_MINUTE", data.get('data') or [], since, end)
+            except Exception as e:
+                self._log_error('getCandleData', e)
+                return None
+        return self.candle_cache.range(token, "ONE_MINUTE", start, end)
+    
+    async def place_order(self, symbol, token, transaction_type, quantity, order_type="MARKET", price=0, tag=None):
+        if Config.MODE == "PAPER":
+            return self.client.place_order(symbol, token, transaction_type, quantity, order_type, price, tag)
         
-        print(Fore.YELLOW + "📡 Connecting to NSE...")
-        session.get("https://www.nseindia.com", timeout=10)
-        time.sleep(2)
+        try:
+            log.message(f"📤 {transaction_type}: {quantity} {symbol}", Fore.CYAN)
+            params = {
+                "variety": "NORMAL", "tradingsymbol": symbol, "symboltoken": str(token),
+                "transactiontype": transaction_type, "exchange": "NFO", "ordertype": order_type,
+                "producttype": "INTRADAY", "duration": "DAY",
+                "price": str(price) if order_type == "LIMIT" else "0",
+                "squareoff": "0", "stoploss": "0", "quantity": str(quantity)
+            }
+            if tag:
+                params["ordertag"] = tag
+            response = await self._call('placeOrder', LANE_ORDER, params)
+            if not isinstance(response, dict):
+                # No reply we can read - the order may still have been taken, the order book decides
+                return {'success': False, 'error': f'Unexpected type: {type(response)}', 'unconfirmed': True}
+            order_id = (response.get('data') or {}).get('orderid') if response.get('status') else None
+            if order_id:
+                log.message(f"✅ ORDER: {order_id}", Fore.GREEN)
+                return {'success': True, 'orderid': str(order_id), 'data': response['data']}
+            if response.get('status') in [True, 'true']:
+                return {'success': True, 'orderid': 'PENDING_VERIFICATION', 'data': response}
+            error_msg = response.get('message') or str(response)
+            if response.get('errorcode'):
+                error_msg = f"{error_msg} ({response['errorcode']})"
+            log.message(f"❌ FAILED: {error_msg}", Fore.RED, level='ERROR')
+            return {'success': False, 'error': error_msg}
+        except Exception as e:
+            log.message(f"❌ Exception: {e}", Fore.RED, level='ERROR')
+            # Anything but a throttle may have failed after the broker took the order - not a rejection
+            return {'success': False, 'error': str(e), 'unconfirmed': not isinstance(e, ThrottledError)}
+    
+    async def fetch_order_book(self):
+        """Today's orders without printing - the same contract as AngelClient.fetch_order_book"""
+        if Config.MODE == "PAPER":
+            return self.paper.order_book()
+        try:
+            response = await self._call('orderBook', LANE_ORDER, method="GET")
+            return (response.get('data') or []) if response.get('status') else []
+        except Exception as e:
+            self._log_error('orderBook', e)
+            return []
+
+# ============================================================================
+# INSTRUMENT STORE
+# ============================================================================
+
+class InstrumentStore:
+    """ScripMaster parsed once per day into compact column arrays + hash indexes, persisted to disk"""
+    TEXT_COLUMNS = ('token', 'symbol', 'name', 'expiry', 'instrumenttype', 'exch_seg')
+    SORT_ORDER = ['name', 'expiry', 'exch_seg', 'instrumenttype', 'strike', 'symbol']
+    
+    def __init__(self, url, cache_dir):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.day = None
+        self._data = None
+    
+    def __len__(self):
+        return len(self._data['token']) if self._data else 0
+    
+    def load(self, force_refresh=False):
+        """Load today's master - from the on-disk snapshot if present, else download and index it"""
+        today = datetime.now().strftime('%Y%m%d')
+        if self.day == today and not force_refresh:
+            return self
+        
+        path = os.path.join(self.cache_dir, f"scrip_master_{today}.pkl")
+        started = time.perf_counter()
+        if os.path.exists(path) and not force_refresh:
+            with open(path, 'rb') as f:
+                self._data = pickle.load(f)
+            print(f"{Fore.GREEN}✓ ScripMaster loaded from cache: {len(self):,} instruments "
+                  f"({(time.perf_counter() - started) * 1000:.0f}ms)")
+        else:
+            print(f"{Fore.CYAN}📥 Downloading ScripMaster...")
+            import requests
+            response = requests.get(self.url, timeout=15)
+            response.raise_for_status()
+            self._data = self.build(response.json())
+            self._persist(path)
+            print(f"{Fore.GREEN}✓ ScripMaster loaded: {len(self):,} instruments "
+                  f"({(time.perf_counter() - started) * 1000:.0f}ms)")
         
-        print(Fore.YELLOW + "📊 Fetching FnO stocks data...")
-        fno_url = "https://www.nseindia.com/api/equity-stockIndices?index=SECURITIES%20IN%20F%26O"
-        response = session.get(fno_url, timeout=15)
+        self.day = today
+        return self
+    
+    @classmethod
+    def build(cls, rows):
+        """Parse raw ScripMaster rows into sorted columns and index tables"""
+        import pandas as pd
+        df = pd.DataFrame(rows, columns=list(cls.TEXT_COLUMNS) + ['strike', 'lotsize']).fillna('')
+        df['strike'] = pd.to_numeric(df['strike'], errors='coerce').fillna(-100) / 100
+        df['lotsize'] = pd.to_numeric(df['lotsize'], errors='coerce').fillna(0).astype('int32')
+        df = df.sort_values(cls.SORT_ORDER, kind='stable').reset_index(drop=True)
+        
+        data = {col: np.array([v.encode() for v in df[col].astype(str)], dtype='S') for col in cls.TEXT_COLUMNS}
+        data['strike'] = df['strike'].to_numpy('float64')
+        data['lotsize'] = df['lotsize'].to_numpy('int32')
+        
+        # Hash indexes: key -> (start, end) into one flat row-id array
+        for name, keys in (('segment', ['name', 'exch_seg', 'instrumenttype']), ('expiry', ['name', 'expiry'])):
+            offsets, chunks, pos = {}, [], 0
+            for key, ids in df.groupby(keys, sort=False).indices.items():
+                offsets[key] = (pos, pos + len(ids))
+                chunks.append(ids)
+                pos += len(ids)
+            data[f'{name}_index'] = offsets
+            data[f'{name}_rows'] = np.concatenate(chunks).astype('int32') if chunks else np.empty(0, 'int32')
+        
+        # Option chains are contiguous and strike-sorted thanks to SORT_ORDER: (name, expiry) -> (start, end, type)
+        options = df[(df['exch_seg'] == 'NFO') & df['instrumenttype'].isin(['OPTSTK', 'OPTIDX'])]
+        data['strike_index'] = {}
+        for key, positions in options.groupby(['name', 'expiry'], sort=False).indices.items():
+            rows = options.index[positions]
+            data['strike_index'][key] = (int(rows[0]), int(rows[-1]) + 1, options.at[rows[0], 'instrumenttype'])
+        
+        tokens = pd.to_numeric(df['token'], errors='coerce').fillna(-1).to_numpy('int64')
+        data['token_order'] = np.argsort(tokens, kind='stable').astype('int32')
+        data['token_sorted'] = tokens[data['token_order']]
+        return data
+    
+    def _persist(self, path):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self._data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            for old in os.listdir(self.cache_dir):
+                if old.startswith('scrip_master_') and os.path.join(self.cache_dir, old) != path:
+                    os.remove(os.path.join(self.cache_dir, old))
+        except OSError as e:
+            print(f"{Fore.YELLOW}⚠️ Could not persist ScripMaster snapshot: {e}")
+    
+    def row(self, i):
+        d = self._data
+        row = {col: d[col][i].decode() for col in self.TEXT_COLUMNS}
+        row['strike'] = float(d['strike'][i])
+        row['lotsize'] = int(d['lotsize'][i])
+        return row
+    
+    def _lookup(self, index, key):
+        start, end = self._data[f'{index}_index'].get(key, (0, 0))
+        return self._data[f'{index}_rows'][start:end]
+    
+    def find(self, name, exch_seg, instrumenttype):
+        return [self.row(i) for i in self._lookup('segment', (name, exch_seg, instrumenttype))]
+    
+    def by_expiry(self, name, expiry):
+        return [self.row(i) for i in self._lookup('expiry', (name, expiry))]
+    
+    def equity(self, name):
+        return next((r for r in self.find(name, 'NSE', '') if r['symbol'].endswith('-EQ')), None)
+    
+    def by_token(self, token):
+        sorted_tokens = self._data['token_sorted']
+        i = np.searchsorted(sorted_tokens, int(token))
+        if i < len(sorted_tokens) and sorted_tokens[i] == int(token):
+            return self.row(self._data['token_order'][i])
+        return None
+    
+    def lot_size(self, name):
+        for instrumenttype in ('FUTSTK', 'OPTSTK'):
+            ids = self._lookup('segment', (name, 'NFO', instrumenttype))
+            if len(ids):
+                return int(self._data['lotsize'][ids[0]])
+        return None
+    
+    def nearest_expiry(self, name=None, instrumenttype='OPTSTK', after=None):
+        """Nearest option expiry strictly after `after` (default today), e.g. '28OCT2025'"""
+        after = (after or datetime.now()).date()
+        expiries = set()
+        for (key_name, expiry), (_, _, key_type) in self._data['strike_index'].items():
+            if key_type == instrumenttype and (name is None or key_name == name):
+                expiries.add(expiry)
+        dated = sorted((datetime.strptime(e, '%d%b%Y').date(), e) for e in expiries)
+        return next((e for d, e in dated if d > after), None)
+    
+    def atm(self, name, expiry, spot):
+        """Binary-search the strike-sorted chain for the ATM strike - returns (strike, ce_row, pe_row)"""
+        start, end, _ = self._data['strike_index'].get((name, expiry), (0, 0, None))
+        if start == end:
+            return None
         
+        strikes = self._data['strike'][start:end]
+        i = int(np.searchsorted(strikes, spot))
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(strikes)]
+        strike = min((strikes[j] for j in candidates), key=lambda k: (abs(k - spot), k))
+        
+        lo, hi = np.searchsorted(strikes, strike, 'left'), np.searchsorted(strikes, strike, 'right')
+        legs = {}
+        for j in range(start + lo, start + hi):
+            symbol = self._data['symbol'][j].decode()
+            legs.setdefault(symbol[-2:], self.row(j))
+        if 'CE' not in legs or 'PE' not in legs:
+            return None
+        return float(strike), legs['CE'], legs['PE']
+
+# ============================================================================
+# STREAMING MARKET FEED
+# ============================================================================
+
+class PriceTable:
+    """Thread-safe latest-price table keyed by token"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._prices = {}
+        self.version = 0
+    
+    def update(self, token, ltp, ts=None):
+        with self._cond:
+            self._prices[token] = (ltp, ts or time.time())
+            self.version += 1
+            self._cond.notify_all()
+    
+    def update_many(self, prices, ts=None):
+        """Apply a {token: ltp} batch under one lock - waiters wake once"""
+        ts = ts or time.time()
+        with self._cond:
+            for token, ltp in prices.items():
+                if ltp > 0:
+                    self._prices[token] = (ltp, ts)
+            self.version += 1
+            self._cond.notify_all()
+    
+    def get(self, token, default=0):
+        entry = self._prices.get(token)
+        return entry[0] if entry else default
+    
+    def wait(self, version, timeout):
+        """Block until the table moves past `version` (or timeout), return the current version"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class MarketFeed:
+    """Persistent SmartAPI WebSocket V2 feed (LTP mode) with auto-reconnect and resubscribe"""
+    EXCHANGE_TYPES = {'NSE': 1, 'NFO': 2, 'BSE': 3, 'BFO': 4, 'MCX': 5}
+    LTP_MODE = 1
+    SUBSCRIBE, UNSUBSCRIBE = 1, 0
+    # mode, exchange type, token (null padded), sequence, exchange timestamp (ms), ltp (paise)
+    PACKET = struct.Struct('<BB25sqqq')
+    
+    def __init__(self, url, headers, prices=None, recorder=None):
+        self.url = url
+        self.headers = headers  # callable - the handshake headers are fetched again for every connect
+        self.prices = prices or PriceTable()
+        self.recorder = recorder
+        self.subscriptions = {}
+        self.connected = False
+        self.running = False
+        self.reconnects = 0
+        self._app = None
+        self._lock = threading.Lock()
+        self._seen_version = 0
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="market-feed", daemon=True).start()
+        return self
+    
+    def stop(self):
+        self.running = False
+        if self._app:
+            self._app.close()
+    
+    def _run(self):
+        import websocket
+        delay = 1
+        while self.running:
+            self._app = websocket.WebSocketApp(
+                self.url, header=self.headers(),
+                on_open=self._on_open, on_message=self._on_message,
+                on_error=self._on_error, on_close=self._on_close
+            )
+            started = time.time()
+            self._app.run_forever(ping_interval=Config.FEED_HEARTBEAT, ping_payload="ping")
+            self.connected = False
+            if not self.running:
+                break
+            
+            # A session that stayed up for a while resets the backoff
+            if time.time() - started > Config.FEED_RECONNECT_MAX:
+                delay = 1
+            self.reconnects += 1
+            metrics.reconnects.inc()
+            print(Fore.YELLOW + f"⚠️ Feed disconnected - reconnecting in {delay}s (#{self.reconnects})")
+            time.sleep(delay)
+            delay = min(delay * 2, Config.FEED_RECONNECT_MAX)
+    
+    def _send(self, action, token_map):
+        self._app.send(json.dumps({
+            "correlationID": "tradebot01",
+            "action": action,
+            "params": {
+                "mode": self.LTP_MODE,
+                "tokenList": [{"exchangeType": etype, "tokens": sorted(tokens)} for etype, tokens in token_map.items()]
+            }
+        }))
+    
+    def subscribe(self, instruments):
+        """Add any instrument tokens that are not on the feed yet"""
+        new = {}
+        with self._lock:
+            for inst in instruments:
+                etype = self.EXCHANGE_TYPES[inst['exchange']]
+                token = str(inst['token'])
+                tokens = self.subscriptions.setdefault(etype, set())
+                if token not in tokens:
+                    tokens.add(token)
+                    new.setdefault(etype, set()).add(token)
+        
+        if new and self.connected:
+            try:
+                self._send(self.SUBSCRIBE, new)
+            except Exception as e:
+                print(Fore.RED + f"❌ Feed subscribe failed: {e}")
+    
+    def unsubscribe(self, instruments):
+        """Take instrument tokens off the feed - they are not resubscribed on reconnect either"""
+        gone = {}
+        with self._lock:
+            for inst in instruments:
+                etype = self.EXCHANGE_TYPES[inst['exchange']]
+                token = str(inst['token'])
+                if token in self.subscriptions.get(etype, ()):
+                    self.subscriptions[etype].discard(token)
+                    gone.setdefault(etype, set()).add(token)
+        
+        if gone and self.connected:
+            try:
+                self._send(self.UNSUBSCRIBE, gone)
+            except Exception as e:
+                print(Fore.RED + f"❌ Feed unsubscribe failed: {e}")
+    
+    def wait_prices(self, instruments, timeout):
+        """Wait for the next price update, then return {key: ltp} for the instruments"""
+        self._seen_version = self.prices.wait(self._seen_version, timeout)
+        return {inst['key']: self.prices.get(str(inst['token'])) for inst in instruments}
+    
+    def _on_open(self, app):
+        self.connected = True
+        with self._lock:
+            token_map = {etype: set(tokens) for etype, tokens in self.subscriptions.items() if tokens}
+        if token_map:
+            self._send(self.SUBSCRIBE, token_map)
+        print(Fore.GREEN + f"📡 Feed connected - {sum(len(t) for t in token_map.values())} tokens subscribed")
+    
+    def _on_message(self, app, message):
+        if not isinstance(message, bytes) or len(message) < self.PACKET.size:
+            return  # heartbeat "pong" / text status frames
+        _, _, raw_token, _, exch_ts, ltp = self.PACKET.unpack_from(message)
+        token = raw_token.split(b'\0', 1)[0].decode()
+        self.prices.update(token, ltp / 100, exch_ts / 1000)
+        if self.recorder:
+            self.recorder.record(token, ltp / 100, exch_ts / 1000)
+    
+    def _on_error(self, app, error):
+        print(Fore.RED + f"❌ Feed error: {error}")
+    
+    def _on_close(self, app, status_code=None, msg=None):
+        self.connected = False
+
+# ============================================================================
+# PAPER EXCHANGE
+# ============================================================================
+
+class PaperExchange:
+    """Simulated exchange for PAPER mode - orders fill against the latest cached tick on a background thread"""
+    TICK_SIZE = 0.05
+    
+    def __init__(self, prices=None, latency=Config.PAPER_LATENCY, jitter=Config.PAPER_JITTER,
+                 slippage_bps=Config.PAPER_SLIPPAGE_BPS, fill_ratio=Config.PAPER_FILL_RATIO,
+                 fill_interval=Config.PAPER_FILL_INTERVAL, quote_timeout=Config.PAPER_QUOTE_TIMEOUT):
+        self.prices = prices or PriceTable()
+        self.latency = latency
+        self.jitter = jitter
+        self.slippage = slippage_bps / 10000
+        self.fill_ratio = min(max(fill_ratio, 0.01), 1)
+        self.fill_interval = fill_interval
+        self.quote_timeout = quote_timeout
+        self.orders = {}
+        self.trades = []
+        self._due = []  # heap of (due time, seq, order id)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def submit(self, symbol, token, transaction_type, quantity, order_type="MARKET", price=0, tag=None, lot=1):
+        """Accept an order and schedule its first fill - returns at once, the fill happens on the exchange thread
+
+        Partial fills come in whole lots of `lot` (the contract's lot size) - an NFO option never fills 137 of 275.
+        """
+        now = time.time()
+        seq = next(self._ids)
+        order_id = f"PAPER_{int(now)}_{seq}"
+        order = {
+            'orderid': order_id, 'tradingsymbol': symbol, 'symboltoken': str(token),
+            'transactiontype': transaction_type, 'ordertype': order_type, 'price': price,
+            'quantity': quantity, 'filledshares': 0, 'unfilledshares': quantity, 'averageprice': 0,
+            'orderstatus': 'open', 'text': '', 'ordertag': tag or '', 'placed': now, 'updatetime': datetime.fromtimestamp(now, IST).strftime('%H:%M:%S'),
+            'lotsize': lot if lot > 0 and quantity % lot == 0 else 1
+        }
+        with self._cond:
+            self.orders[order_id] = order
+            heapq.heappush(self._due, (now + self.latency + random.uniform(0, self.jitter), seq, order_id))
+            self._cond.notify()
+            # Flatten sends legs from many threads at once - only one of them may start the exchange
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="paper-exchange", daemon=True)
+                self._thread.start()
+        
+        log.message(f"📄 PAPER: {transaction_type} {quantity} {symbol} | ID: {order_id}", Fore.CYAN)
+        return {'success': True, 'orderid': order_id, 'data': {
+            'orderid': order_id, 'mode': 'PAPER', 'price': self.prices.get(str(token)) or price,
+            'quantity': quantity, 'symbol': symbol, 'status': 'open'}}
+    
+    def cancel(self, order_id):
+        """Cancel the unfilled rest of an open order - False once it has completed"""
+        with self._cond:
+            order = self.orders.get(order_id)
+            if not order or order['orderstatus'] != 'open':
+                return False
+            self._finish(order, 'cancelled', "Cancelled by user")
+            return True
+    
+    def reset(self):
+        """Forget every order and trade - the next session starts with an empty book"""
+        with self._cond:
+            self.orders.clear()
+            self.trades.clear()
+            self._due.clear()
+    
+    def order_book(self):
+        with self._cond:
+            return [dict(order) for order in self.orders.values()]
+    
+    def trade_book(self):
+        with self._cond:
+            return list(self.trades)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due or self._due[0][0] > time.time():
+                    self._cond.wait(self._due[0][0] - time.time() if self._due else None)
+                _, seq, order_id = heapq.heappop(self._due)
+                self._match(self.orders[order_id], seq)
+    
+    def _match(self, order, seq):
+        """Fill one slice of an open order at the cached LTP plus slippage, then reschedule whatever is left"""
+        if order['orderstatus'] != 'open':
+            return
+        now = time.time()
+        ltp = self.prices.get(order['symboltoken'])
+        if ltp <= 0:
+            if now - order['placed'] > self.quote_timeout:
+                self._finish(order, 'rejected', "No market data")
+            else:
+                heapq.heappush(self._due, (now + self.fill_interval, seq, order['orderid']))
+            return
+        
+        buy = order['transactiontype'] == 'BUY'
+        fill_price = ltp * (1 + self.slippage if buy else 1 - self.slippage)
+        fill_price = round(round(fill_price / self.TICK_SIZE) * self.TICK_SIZE, 2)
+        if order['ordertype'] == 'LIMIT' and (fill_price > order['price'] if buy else fill_price < order['price']):
+            heapq.heappush(self._due, (now + self.fill_interval, seq, order['orderid']))  # not marketable yet
+            return
+        
+        lots = order['unfilledshares'] // order['lotsize']
+        size = order['lotsize'] * min(lots, max(1, round(lots * self.fill_ratio)))
+        filled = order['filledshares'] + size
+        order['averageprice'] = round((order['averageprice'] * order['filledshares'] + fill_price * size) / filled, 2)
+        order['filledshares'] = filled
+        order['unfilledshares'] -= size
+        order['updatetime'] = datetime.fromtimestamp(now, IST).strftime('%H:%M:%S')
+        self.trades.append({'orderid': order['orderid'], 'tradingsymbol': order['tradingsymbol'],
+                            'transactiontype': order['transactiontype'], 'fillprice': fill_price,
+                            'fillsize': size, 'filltime': order['updatetime']})
+        
+        if order['unfilledshares']:
+            heapq.heappush(self._due, (now + self.fill_interval, seq, order['orderid']))
+        else:
+            self._finish(order, 'complete')
+    
+    def _finish(self, order, status, text=''):
+        order['orderstatus'] = status
+        order['text'] = text
+        if status == 'complete':
+            log.message(f"✅ PAPER FILL: {order['transactiontype']} {order['quantity']} "
+                        f"{order['tradingsymbol']} @ ₹{order['averageprice']:.2f} | ID: {order['orderid']}", Fore.GREEN)
+        else:
+            log.message(f"⚠️ PAPER {status.upper()}: {order['tradingsymbol']} {text} | ID: {order['orderid']}", Fore.YELLOW)
+
+# ============================================================================
+# TICK RECORDER
+# ============================================================================
+
+# Fixed-width tick record: ms since IST midnight, token, ltp (paise), volume - 16 bytes
+TICK_RECORD = np.dtype([('ms', '<u4'), ('token', '<u4'), ('ltp', '<i4'), ('volume', '<u4')])
+# File header: magic, IST midnight (epoch seconds) the ms offsets count from
+TICK_HEADER = struct.Struct('<8sq')
+TICK_MAGIC = b'BBTICK01'
+
+
+class TickRecorder:
+    """Append-only per-day tick files written from a background thread - record() never touches disk"""
+    FLUSH_INTERVAL = 1.0
+    QUEUE_SIZE = 100000
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._file = None
+        self._day = None
+        self._thread = threading.Thread(target=self._run, name="tick-recorder", daemon=True)
+        self._thread.start()
+    
+    def record(self, token, ltp, ts=None, volume=0):
+        try:
+            self._queue.put_nowait((ts or time.time(), token, ltp, volume))
+        except queue.Full:
+            self.dropped += 1
+    
+    def record_many(self, prices, ts=None):
+        """Record a {token: ltp} batch sharing one timestamp"""
+        ts = ts or time.time()
+        for token, ltp in prices.items():
+            if ltp:
+                self.record(token, ltp, ts)
+    
+    @property
+    def closed(self):
+        return not self._thread.is_alive()
+    
+    def close(self):
+        """Flush everything queued so far and stop the writer"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+    
+    def _run(self):
+        pending = []
+        last_flush = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                item = False
+            if item:
+                pending.append(item)
+            if pending and (item is None or item is False or len(pending) >= 4096
+                            or time.time() - last_flush >= self.FLUSH_INTERVAL):
+                try:
+                    self._write(pending)
+                except Exception as e:
+                    print(Fore.RED + f"❌ Tick recorder write failed: {e}")
+                pending = []
+                last_flush = time.time()
+            if item is None:
+                if self._file:
+                    self._file.close()
+                return
+    
+    def _write(self, items):
+        ts, tokens, ltps, volumes = zip(*items)
+        ts = np.asarray(ts, dtype='float64')
+        tokens = np.asarray([int(t) if str(t).isdigit() else 0 for t in tokens], dtype='int64')
+        days = (ts + IST.utcoffset(None).total_seconds()) // 86400
+        for day in np.unique(days):
+            rows = np.flatnonzero((days == day) & (tokens > 0))
+            if not len(rows):
+                continue
+            base = int(day * 86400 - IST.utcoffset(None).total_seconds())
+            block = np.empty(len(rows), dtype=TICK_RECORD)
+            block['ms'] = np.round((ts[rows] - base) * 1000)
+            block['token'] = tokens[rows]
+            block['ltp'] = np.round(np.asarray(ltps, dtype='float64')[rows] * 100)
+            block['volume'] = np.asarray(volumes, dtype='int64')[rows]
+            block.sort(order='ms', kind='stable')
+            self._open(base).write(block.tobytes())
+            self.written += len(block)
+        self._file.flush()
+    
+    def _open(self, base):
+        if self._day != base:
+            if self._file:
+                self._file.close()
+            os.makedirs(self.directory, exist_ok=True)
+            path = tick_file_path(self.directory, datetime.fromtimestamp(base, IST))
+            self._file = open(path, 'ab')
+            if self._file.tell() == 0:
+                self._file.write(TICK_HEADER.pack(TICK_MAGIC, base))
+            self._day = base
+        return self._file
+
+
+def tick_file_path(directory, day):
+    return os.path.join(directory, f"ticks_{day.strftime('%Y%m%d')}.bin")
+
+
+class TickFile:
+    """Memory-mapped reader for one day's tick file"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, self.base = TICK_HEADER.unpack(f.read(TICK_HEADER.size))
+        if magic != TICK_MAGIC:
+            raise ValueError(f"{path} is not a tick file")
+        # Ignore a torn record at the end if the writer died mid-append
+        count = (os.path.getsize(path) - TICK_HEADER.size) // TICK_RECORD.itemsize
+        self.records = (np.memmap(path, dtype=TICK_RECORD, mode='r', offset=TICK_HEADER.size, shape=(count,))
+                        if count else np.empty(0, dtype=TICK_RECORD))
+        self._sorted = None
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def tokens(self):
+        return np.unique(self.records['token'])
+    
+    def select(self, token=None, start=None, end=None):
+        """Records for `token` between epoch-second `start` and `end` - a time range alone is a zero-copy view"""
+        records = self.records
+        if start is not None or end is not None:
+            ms = records['ms']
+            lo = 0 if start is None else max(0, int((start - self.base) * 1000))
+            hi = 2 ** 32 - 1 if end is None else max(0, int((end - self.base) * 1000))
+            if self._sorted is None:
+                self._sorted = bool(np.all(ms[1:] >= ms[:-1]))
+            if self._sorted:
+                records = records[np.searchsorted(ms, lo, 'left'):np.searchsorted(ms, hi, 'right')]
+            else:
+                records = records[(ms >= lo) & (ms <= hi)]
+        if token is not None:
+            records = records[records['token'] == int(token)]
+        return records
+    
+    def series(self, token, start=None, end=None):
+        """(epoch seconds, ltp) float arrays for one token"""
+        records = self.select(token, start, end)
+        return self.base + records['ms'] / 1000, records['ltp'] / 100
+
+# ============================================================================
+# TRADE JOURNAL
+# ============================================================================
+
+class TradeJournal:
+    """Append-only JSONL log of trade events - batched and fsync'd by a background thread, replayed on restart"""
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="trade-journal", daemon=True)
+        self._thread.start()
+    
+    @staticmethod
+    def today_path():
+        return os.path.join(Config.DATA_DIR, Config.LOG_FILE.format(date=datetime.now().strftime('%Y%m%d')))
+    
+    def write(self, event, name=None, **fields):
+        self._queue.put({'ev': event, 'ts': time.time(), 'name': name, **fields})
+    
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+    
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            while True:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = [dumps(event) for event in batch if event is not None]
+                try:
+                    if lines:
+                        f.write('\n'.join(lines) + '\n')
+                        f.flush()
+                        os.fsync(f.fileno())
+                except OSError as e:
+                    print(Fore.RED + f"❌ Trade journal write failed: {e}")
+                if None in batch:
+                    return
+    
+    @staticmethod
+    def recover(path):
+        """Replay a journal into the monitor's trades / highest_pnl / trailing_active / daily_pnl / levels"""
+        state = {'trades': {}, 'highest_pnl': {}, 'trailing_active': {}, 'daily_pnl': {'total': 0, 'trades': []},
+                 'levels': {}, 'stocks': {}}
+        if not os.path.exists(path):
+            return state
+        
+        trades = state['trades']
+        with open(path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash mid-write
+                ev, name = event['ev'], event.get('name')
+                if ev == 'entry':
+                    trades[name] = event['trade']
+                    state['stocks'][name] = event['stock']
+                    state['highest_pnl'][name] = 0
+                    state['trailing_active'][name] = False
+                elif ev == 'level':
+                    state['levels'][name] = (event['level'], event.get('token'))
+                elif ev == 'pnl':
+                    for key, (ltp, pnl, high) in event['positions'].items():
+                        if key in trades:
+                            trades[key].update(ltp=ltp, pnl=pnl)
+                            state['highest_pnl'][key] = high
+                elif ev == 'trail' and name in trades:
+                    trades[name]['trailing_sl'] = event['trailing_sl']
+                    state['trailing_active'][name] = True
+                    state['highest_pnl'][name] = event['high_pnl']
+                elif ev == 'exit' and name in trades:
+                    trades[name].update(event['fields'])
+                    state['daily_pnl']['total'] += event['fields']['pnl']
+                    state['daily_pnl']['trades'].append(trades[name])
+                elif ev == 'order' and name in trades:
+                    state['daily_pnl']['total'] += event['pnl']
+                    if event.get('drop') or event.get('reopen'):
+                        state['daily_pnl']['trades'] = [t for t in state['daily_pnl']['trades'] if t is not trades[name]]
+                    if event.get('drop'):
+                        del trades[name]
+                        state['stocks'].pop(name, None)
+                    else:
+                        trades[name].update(event['fields'])
+        return state
+
+# ============================================================================
+# LONG BUILD UP SCANNER
+# ============================================================================
+
+class NSEScanner:
+    """Long build-up scan over the F&O universe - warm cookie session, concurrent endpoints, TTL-cached responses"""
+    PRICES = "/api/equity-stockIndices?index=SECURITIES%20IN%20F%26O"
+    OI_SPURTS = "/api/live-analysis-oi-spurts-underlyings"
+    DERIVATIVE = "/api/quote-derivative?symbol={symbol}"
+    INDICES = ('NIFTY', 'BANKNIFTY', 'FINNIFTY', 'MIDCPNIFTY', 'NIFTYNXT50')
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Referer': 'https://www.nseindia.com/',
+    }
+    
+    def __init__(self, base_url=Config.NSE_URL, ttl=Config.SCAN_CACHE_TTL, workers=Config.SCAN_WORKERS):
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.workers = workers
+        self.session = None
+        self.warmed = 0
+        self.fetches = 0
+        self._cache = {}  # path -> (fetched at, json)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nse")
+    
+    def warm(self, force=False):
+        """Homepage visit for the session cookies NSE's API wants - once, or again after a 401/403"""
+        with self._lock:
+            if self.session is not None and not force:
+                return self.session
+            import requests
+            session = requests.Session()
+            session.headers.update(self.HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.get(self.base_url, timeout=10)
+            self.session = session
+            self.warmed += 1
+            return session
+    
+    def get(self, path):
+        """GET a JSON endpoint through the TTL cache - a stale cookie session is re-warmed and the call retried once"""
+        cached = self._cache.get(path)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[1]
+        
+        response = self.warm().get(self.base_url + path, timeout=15)
+        if response.status_code in (401, 403):
+            response = self.warm(force=True).get(self.base_url + path, timeout=15)
         if response.status_code != 200:
-            raise Exception(f"Status {response.status_code}")
-        
+            raise Exception(f"{path} returned status {response.status_code}")
         data = response.json()
-        fno_stocks = data.get('data', [])
-        
-        if not fno_stocks:
-            raise Exception("No data received")
-        
-        print(Fore.GREEN + f"✅ Received {len(fno_stocks)} stocks\n")
+        self.fetches += 1
+        self._cache[path] = (time.time(), data)
+        return data
+    
+    def scan(self):
+        """Price-up + OI-up stocks, best first - the price and OI endpoints are fetched together (one round trip)"""
+        import pandas as pd
+        self.warm()
+        prices = self._pool.submit(self.get, self.PRICES)
+        spurts = self._pool.submit(self.get, self.OI_SPURTS)
+        
+        df = pd.DataFrame(prices.result().get('data') or []).reindex(
+            columns=['symbol', 'pChange', 'lastPrice', 'totalTradedVolume'])
+        if df.empty:
+            raise Exception("No F&O price data received")
+        df = pd.DataFrame({
+            'symbol': df['symbol'].astype(str),
+            'price_change_pct': pd.to_numeric(df['pChange'], errors='coerce'),
+            'ltp': pd.to_numeric(df['lastPrice'], errors='coerce'),
+            'volume': pd.to_numeric(df['totalTradedVolume'], errors='coerce'),
+        }).dropna()
+        df = df[~df['symbol'].isin(self.INDICES)]
         
-        for stock in fno_stocks:
-            try:
-                symbol = stock.get('symbol', '')
-                if symbol in ['NIFTY', 'BANKNIFTY', 'FINNIFTY', 'MIDCPNIFTY']:
-                    continue
-                
-                pct_change = float(stock.get('pChange', 0))
-                last_price = float(stock.get('lastPrice', 0))
-                volume = int(stock.get('totalTradedVolume', 0))
-                
-                if pct_change > 0.2 and volume > 100000 and last_price > Config.MIN_STOCK_PRICE:
-                    score = pct_change * (volume / 1000000)
-                    buildup_stocks.append({
-                        'symbol': symbol,
-                        'price_change_pct': pct_change,
-                        'oi_change_pct': pct_change,
-                        'score': score,
-                        'ltp': last_price,
-                        'volume': volume
-                    })
-            except:
+        try:
+            oi = self._oi_frame(spurts.result().get('data') or [])
+        except Exception as e:
+            print(Fore.YELLOW + f"⚠️ OI spurts unavailable ({e}) - fetching OI per symbol")
+            oi = pd.DataFrame(columns=['symbol', 'oi_change_pct'])
+        df = df.merge(oi, on='symbol', how='left')
+        
+        # Symbols the bulk OI response left out (only price-up ones matter) - one quote-derivative call each, bounded
+        movers = (df['price_change_pct'] > 0.2) & df['oi_change_pct'].isna()
+        if movers.any():
+            missing = df.loc[movers, 'symbol'].tolist()
+            fetched = dict(zip(missing, self._pool.map(self._derivative_oi, missing)))
+            df.loc[movers, 'oi_change_pct'] = df.loc[movers, 'symbol'].map(fetched)
+        
+        return self.rank(df)
+    
+    @staticmethod
+    def rank(df):
+        """Long build-up = price up + OI up on real volume, scored by the two changes together"""
+        df = df.astype({'oi_change_pct': 'float64'})
+        mask = ((df['price_change_pct'] > 0.2) & (df['oi_change_pct'] > 0) &
+                (df['volume'] > 100000) & (df['ltp'] > Config.MIN_STOCK_PRICE)).to_numpy()
+        picked = df[mask].assign(score=lambda d: d['price_change_pct'] + d['oi_change_pct'])
+        picked = picked.sort_values('score', ascending=False, kind='stable')
+        return picked[['symbol', 'price_change_pct', 'oi_change_pct', 'score', 'ltp', 'volume']].to_dict('records')
+    
+    @staticmethod
+    def _oi_frame(rows):
+        import pandas as pd
+        oi = pd.DataFrame(rows).reindex(columns=['symbol', 'prevOI', 'changeInOI', 'avgInOI'])
+        if oi.empty:
+            return pd.DataFrame(columns=['symbol', 'oi_change_pct'])
+        prev = pd.to_numeric(oi['prevOI'], errors='coerce')
+        change = pd.to_numeric(oi['changeInOI'], errors='coerce')
+        pct = np.where(prev > 0, change / prev.where(prev > 0) * 100, pd.to_numeric(oi['avgInOI'], errors='coerce'))
+        return pd.DataFrame({'symbol': oi['symbol'].astype(str), 'oi_change_pct': pct}).drop_duplicates('symbol')
+    
+    def _derivative_oi(self, symbol):
+        """Futures OI change % for one symbol, summed over the listed expiries"""
+        try:
+            data = self.get(self.DERIVATIVE.format(symbol=quote(symbol)))
+        except Exception:
+            return np.nan
+        oi = change = 0
+        for contract in data.get('stocks', []):
+            if 'Futures' not in contract.get('metadata', {}).get('instrumentType', ''):
                 continue
-        
-        buildup_stocks.sort(key=lambda x: x['score'], reverse=True)
+            info = contract.get('marketDeptOrderBook', {}).get('tradeInfo', {})
+            oi += float(info.get('openInterest') or 0)
+            change += float(info.get('changeinOpenInterest') or 0)
+        return change / (oi - change) * 100 if oi - change > 0 else np.nan
+
+
+def fetch_long_buildup_from_nse(scanner=None):
+    """
+    Fetch REAL Long Build Up stocks from NSE using FnO data
+    Long Build Up = Price UP + OI UP (Bullish signal)
+    FILTERS STOCKS WITH LTP > Config.MIN_STOCK_PRICE
+    """
+    print(Fore.CYAN + f"\n{'='*70}\n🔍 FETCHING REAL LONG BUILD UP STOCKS FROM NSE\n{'='*70}\n")
+    print(Fore.YELLOW + f"📊 Filtering stocks with LTP > ₹{Config.MIN_STOCK_PRICE}\n")
+    
+    buildup_stocks = []
+    
+    try:
+        scanner = scanner or NSEScanner()
+        started = time.perf_counter()
+        buildup_stocks = scanner.scan()
+        print(Fore.GREEN + f"✅ {len(buildup_stocks)} long build-up stocks in {(time.perf_counter() - started) * 1000:,.0f}ms\n")
         
     except Exception as e:
         print(Fore.RED + f"❌ Error fetching from NSE: {e}")
@@ -445,7 +2279,13 @@ def fetch_long_buildup_from_nse():
 # UTILITIES
 # ============================================================================
 
-def get_expiry():
+def get_expiry(store=None):
+    """Nearest stock-option expiry - read from the instrument master when loaded, else the last-Tuesday rule"""
+    if store is not None:
+        expiry = store.nearest_expiry(instrumenttype='OPTSTK')
+        if expiry:
+            return expiry
+    
     import calendar
     today = datetime.now()
     year, month = today.year, today.month
@@ -465,51 +2305,61 @@ def get_expiry():
     
     return last_date.strftime('%d%b%Y').upper()
 
-def get_atm(client, symbol, expiry):
+def get_atm(client, symbol, expiry, timings=None):
+    """Resolve the ATM CE/PE pair for one stock, recording per-stage latency (ms) into `timings`"""
+    timings = {} if timings is None else timings
+    
+    def stage(name, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[name] = (time.perf_counter() - started) * 1000
+    
     try:
-        results = client.search("NSE", f"{symbol}-EQ")
-        if not results:
+        store = client._load_scrip_master()
+        if store is None:
             return None
         
-        stock = next((r for r in results if r.get('tradingsymbol', '').endswith('-EQ')), None)
+        # The master already carries the equity token - searchScrip (1 req/s) is only a fallback
+        equity = store.equity(symbol)
+        if equity:
+            stock = {'tradingsymbol': equity['symbol'], 'symboltoken': equity['token']}
+        else:
+            results = stage('search', client.search, "NSE", f"{symbol}-EQ")
+            stock = next((r for r in results if r.get('tradingsymbol', '').endswith('-EQ')), None)
         if not stock:
             return None
         
-        ltp_data = client.smart_api.ltpData("NSE", stock['tradingsymbol'], stock['symboltoken'])
-        spot = float(ltp_data.get('data', {}).get('ltp', 0))
+        spot = stage('spot', client.get_ltp, "NSE", stock['tradingsymbol'], stock['symboltoken'], LANE_BACKGROUND)
         if spot <= 0:
             return None
         
-        lot = client.get_lot_size(symbol)
+        lot = stage('lot', client.get_lot_size, symbol)
         if not lot:
             return None
         
-        response = requests.get('https://margincalculator.angelone.in/OpenAPI_File/files/OpenAPIScripMaster.json', timeout=10)
-        df = pd.DataFrame(response.json())
-        
-        expiry_fmt = f"{expiry[:2]}{expiry[2:5]}{expiry[5:]}"
-        options_df = df[(df['name'] == symbol) & (df['expiry'] == expiry_fmt) & 
-                       (df['exch_seg'] == 'NFO') & (df['instrumenttype'] == 'OPTSTK')].copy()
-        
-        if options_df.empty:
+        chain = stage('chain', store.atm, symbol, expiry, spot)
+        if not chain:
             return None
-        
-        options_df['strike'] = pd.to_numeric(options_df['strike']) / 100
-        options_df['distance'] = abs(options_df['strike'] - spot)
-        atm_strike = options_df.loc[options_df['distance'].idxmin(), 'strike']
-        
-        ce = options_df[(options_df['strike'] == atm_strike) & (options_df['symbol'].str.endswith('CE'))].iloc[0]
-        pe = options_df[(options_df['strike'] == atm_strike) & (options_df['symbol'].str.endswith('PE'))].iloc[0]
-        
-        ce_candle = client.get_candle_data("NFO", ce['symbol'], ce['token'])
-        pe_candle = client.get_candle_data("NFO", pe['symbol'], pe['token'])
-        ce_ltp = float(client.smart_api.ltpData("NFO", ce['symbol'], ce['token']).get('data', {}).get('ltp', 0))
-        pe_ltp = float(client.smart_api.ltpData("NFO", pe['symbol'], pe['token']).get('data', {}).get('ltp', 0))
+        atm_strike, ce, pe = chain
+        
+        # CE/PE candles and both option LTPs are independent - fetch them together
+        legs = [{'key': 'CE', 'exchange': 'NFO', 'token': ce['token']},
+                {'key': 'PE', 'exchange': 'NFO', 'token': pe['token']}]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            ce_candle = pool.submit(stage, 'ce_candle', client.get_candle_data, "NFO", ce['symbol'], ce['token'])
+            pe_candle = pool.submit(stage, 'pe_candle', client.get_candle_data, "NFO", pe['symbol'], pe['token'])
+            ltps = pool.submit(stage, 'ltp', client.get_ltp_batch, legs)
+            ce_candle, pe_candle, ltps = ce_candle.result(), pe_candle.result(), ltps.result()
+        timings['market_data'] = (time.perf_counter() - started) * 1000
+        ce_ltp, pe_ltp = ltps['CE'], ltps['PE']
         
         if ce_candle and pe_candle:
-            print(Fore.CYAN + f"\n{symbol:<12} Spot: ₹{spot:.2f} | ATM: {int(atm_strike)} | Lot: {lot}")
-            print(Fore.GREEN + f"CE: O:{ce_candle['open']:.2f} H:{ce_candle['high']:.2f} L:{ce_candle['low']:.2f} C:{ce_candle['close']:.2f} | Time: {ce_candle['timestamp']}")
-            print(Fore.RED + f"PE: O:{pe_candle['open']:.2f} H:{pe_candle['high']:.2f} L:{pe_candle['low']:.2f} C:{pe_candle['close']:.2f} | Time: {pe_candle['timestamp']}")
+            log.message(f"\n{symbol:<12} Spot: ₹{spot:.2f} | ATM: {int(atm_strike)} | Lot: {lot}\n" +
+                        Fore.GREEN + f"CE: O:{ce_candle['open']:.2f} H:{ce_candle['high']:.2f} L:{ce_candle['low']:.2f} C:{ce_candle['close']:.2f} | Time: {ce_candle['timestamp']}\n" +
+                        Fore.RED + f"PE: O:{pe_candle['open']:.2f} H:{pe_candle['high']:.2f} L:{pe_candle['low']:.2f} C:{pe_candle['close']:.2f} | Time: {pe_candle['timestamp']}", Fore.CYAN)
             
             return {
                 "symbol": symbol, "spot": spot, "atm": int(atm_strike), "lot": lot, "expiry": expiry,
@@ -519,56 +2369,838 @@ def get_atm(client, symbol, expiry):
                 "ce_high": ce_candle['high'], "pe_high": pe_candle['high'],
                 "ce_low": ce_candle['low'], "pe_low": pe_candle['low'],
                 "ce_close": ce_candle['close'], "pe_close": pe_candle['close'],
-                "ce_volume": ce_candle.get('volume', 0), "pe_volume": pe_candle.get('volume', 0)
+                "ce_volume": ce_candle.get('volume', 0), "pe_volume": pe_candle.get('volume', 0),
+                "ce_bars": ce_candle.get('bars', []), "pe_bars": pe_candle.get('bars', [])
             }
     except Exception as e:
-        print(Fore.RED + f"❌ {symbol}: {e}")
+        log.message(f"❌ {symbol}: {e}", Fore.RED, level='ERROR')
     return None
 
-def is_open():
-    import pytz
-    IST = pytz.timezone('Asia/Kolkata')
-    now = datetime.now(IST)
+def build_watchlist(client, buildup_stocks, expiry):
+    """Run get_atm for every stock on a bounded worker pool - ready in ~the slowest symbol's time"""
+    started = time.perf_counter()
+    client._load_scrip_master()  # warm the instrument store once before fanning out
+    
+    timings = {s['symbol']: {} for s in buildup_stocks}
+    with ThreadPoolExecutor(max_workers=Config.WATCHLIST_WORKERS, thread_name_prefix="watchlist") as pool:
+        futures = [pool.submit(get_atm, client, s['symbol'], expiry, timings[s['symbol']]) for s in buildup_stocks]
+        watchlist = [atm for atm in (f.result() for f in futures) if atm]
+    
+    elapsed = (time.perf_counter() - started) * 1000
+    stages = ['search', 'spot', 'lot', 'chain', 'market_data']
+    log.flush()
+    print(Fore.CYAN + f"\n⏱️ Watchlist built in {elapsed:,.0f}ms ({len(watchlist)}/{len(buildup_stocks)} symbols)")
+    print(Fore.CYAN + f"{'SYMBOL':<12}" + "".join(f"{name:>13}" for name in stages))
+    for symbol, stage_ms in timings.items():
+        print(Fore.YELLOW + f"{symbol:<12}" + "".join(f"{stage_ms[name]:>11,.0f}ms" if name in stage_ms else f"{'-':>13}" for name in stages))
+    return watchlist
+
+class WatchlistRotator:
+    """Periodic rescan on its own thread - ATM contracts are resolved only for new leaders, the monitor applies the diff between ticks"""
+    def __init__(self, monitor, client, expiry, scanner=None, interval=Config.RESCAN_INTERVAL):
+        self.monitor = monitor
+        self.client = client
+        self.expiry = expiry
+        self.scanner = scanner or NSEScanner()
+        self.interval = interval
+        self.rotations = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rescan", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.rescan()
+            except Exception as e:
+                log.message(f"❌ Rescan failed: {e}", Fore.RED, level='ERROR')
+    
+    def rescan(self):
+        """Diff today's build-up leaders against the watchlist and hand the change to the monitor"""
+        leaders = self.scanner.scan()[:Config.MAX_STOCKS_TO_TRADE]
+        if not leaders:
+            return
+        current = {stock['symbol'] for stock in list(self.monitor.watchlist)}
+        wanted = {stock['symbol'] for stock in leaders}
+        new = [stock for stock in leaders if stock['symbol'] not in current]
+        gone = current - wanted
+        if not new and not gone:
+            return
+        
+        stocks = build_watchlist(self.client, new, self.expiry) if new else []
+        self.monitor.rotate(stocks, gone)
+        self.rotations += 1
+
+class SystemClock:
+    """Wall clock in IST"""
+    def now(self):
+        return datetime.now(IST)
+    
+    def time(self):
+        return time.time()
+    
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class SimClock:
+    """Simulated clock for backtests - sleep() advances time instantly"""
+    def __init__(self, start):
+        self._now = start
+    
+    def now(self):
+        return self._now
+    
+    def time(self):
+        return self._now.timestamp()
+    
+    def sleep(self, seconds):
+        self._now += timedelta(seconds=seconds)
+
+def is_open(now=None):
+    if now is None:
+        now = SystemClock().now()
     if now.weekday() >= 5:
         return False
     market_open = now.replace(hour=9, minute=15, second=0, microsecond=0)
     market_close = now.replace(hour=15, minute=30, second=0, microsecond=0)
     return market_open <= now <= market_close
 
-def should_auto_exit():
+def should_auto_exit(now=None):
     """Check if it's time for auto-exit (3:15 PM IST)"""
-    import pytz
-    IST = pytz.timezone('Asia/Kolkata')
-    now = datetime.now(IST)
+    if now is None:
+        now = SystemClock().now()
     exit_hour, exit_minute = map(int, Config.AUTO_EXIT_TIME.split(':'))
     exit_time = now.replace(hour=exit_hour, minute=exit_minute, second=0, microsecond=0)
     return now >= exit_time
 
+# ============================================================================
+# CANDLE BUILDER
+# ============================================================================
+
+class CandleBuilder:
+    """Incremental OHLCV bars per token from the tick stream - O(1) per tick, on_close fires as each bar completes"""
+    INTERVALS = {'ONE_MINUTE': 60, 'THREE_MINUTE': 180, 'FIVE_MINUTE': 300}
+    
+    def __init__(self, intervals=(60, 180, 300), on_close=None):
+        self.intervals = tuple(intervals)
+        self.on_close = on_close
+        self._bars = {}    # (token, interval) -> [start, open, high, low, close, volume, partial]
+        self._closed = {}  # (token, interval) -> last completed candle
+    
+    def update(self, token, ltp, ts, volume=0):
+        if ltp > 0:
+            self._merge(token, ts, ltp, ltp, ltp, ltp, volume)
+    
+    def seed(self, token, bars):
+        """Prime a token from historical ONE_MINUTE bars [start, open, high, low, close, volume] - no events fire"""
+        on_close, self.on_close = self.on_close, None
+        try:
+            for start, o, h, l, c, v in bars:
+                self._merge(token, start, o, h, l, c, v, partial=False)
+        finally:
+            self.on_close = on_close
+    
+    def flush(self, now):
+        """Close every bar whose interval has ended - quiet tokens still get their candle on time"""
+        for key, bar in list(self._bars.items()):
+            if bar[0] + key[1] <= now:
+                del self._bars[key]
+                self._close(key, bar)
+    
+    def last(self, token, interval):
+        return self._closed.get((token, interval))
+    
+    def drop(self, token):
+        """Forget a token that is no longer watched"""
+        for interval in self.intervals:
+            self._bars.pop((token, interval), None)
+            self._closed.pop((token, interval), None)
+    
+    def _merge(self, token, ts, o, h, l, c, v, partial=True):
+        for interval in self.intervals:
+            key = (token, interval)
+            start = ts - ts % interval
+            bar = self._bars.get(key)
+            if bar is not None and start == bar[0]:
+                bar[2] = max(bar[2], h)
+                bar[3] = min(bar[3], l)
+                bar[4] = c
+                bar[5] += v
+                continue
+            if bar is not None and start < bar[0]:
+                continue  # late tick for a bar that is already gone
+            if bar is not None:
+                self._close(key, bar)
+            # The first bar seen mid-way through (no history) is incomplete - its high/low can't be trusted
+            first = bar is None and key not in self._closed
+            self._bars[key] = [start, o, h, l, c, v, partial and first]
+    
+    def _close(self, key, bar):
+        start, o, h, l, c, v, partial = bar
+        candle_time = datetime.fromtimestamp(start, IST).replace(tzinfo=None)
+        candle = {
+            'open': o, 'high': h, 'low': l, 'close': c, 'volume': v,
+            'timestamp': candle_time.strftime('%H:%M:%S'),
+            'candle_time': candle_time,
+            'partial': partial
+        }
+        self._closed[key] = candle
+        if self.on_close:
+            self.on_close(key[0], key[1], candle)
+
+# ============================================================================
+# CANDLE CACHE
+# ============================================================================
+
+class CandleCache:
+    """Parsed historical bars per (token, interval) in compact arrays - LRU in memory, finished sessions on disk"""
+    COLUMNS = ('start', 'open', 'high', 'low', 'close', 'volume')
+    SESSION_CLOSE = (15, 30)
+    
+    def __init__(self, directory, capacity=512):
+        self.directory = directory
+        self.capacity = capacity
+        self.hits = 0
+        self.fetches = 0
+        self._entries = OrderedDict()  # (token, interval) -> {'bars': (n, 6) array, 'fetched_from'/'fetched_to': ts, 'saved': n}
+        self._lock = threading.Lock()
+    
+    def missing_since(self, token, interval, start, end):
+        """Epoch second the network fetch has to start from, or None if the cache already covers [start, end]"""
+        with self._lock:
+            entry = self._entry((token, interval))
+            bars = entry['bars']
+            if not len(bars) or start < entry['fetched_from']:
+                return start
+            if end <= entry['fetched_to']:
+                self.hits += 1
+                return None
+            # The last cached bar may still have been forming - fetch again from its start, never from before `start`
+            return max(start, bars[-1, 0])
+    
+    def add(self, token, interval, rows, fetched_from, fetched_to):
+        """Merge raw getCandleData rows for [fetched_from, fetched_to] in, replacing any cached bars they overlap"""
+        bars = self.parse(rows)
+        with self._lock:
+            self.fetches += 1
+            entry = self._entry((token, interval))
+            if not len(entry['bars']) or fetched_from < entry['fetched_from']:
+                entry['fetched_from'] = fetched_from
+            if len(bars):
+                cached = entry['bars']
+                keep = cached[cached[:, 0] < bars[0, 0]] if len(cached) else cached
+                entry['bars'] = np.concatenate([keep, bars]) if len(keep) else bars
+                entry['saved'] = min(entry['saved'], len(keep))
+            entry['fetched_to'] = max(entry['fetched_to'], fetched_to)
+    
+    def range(self, token, interval, start, end):
+        with self._lock:
+            bars = self._entry((token, interval))['bars']
+        if not len(bars):
+            return bars
+        lo, hi = np.searchsorted(bars[:, 0], [start - start % CandleBuilder.INTERVALS[interval], end], 'left')
+        return bars[lo:hi]
+    
+    def save(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._persist(key)
+    
+    @staticmethod
+    def parse(rows):
+        """Raw rows [timestamp, o, h, l, c, v] -> (n, 6) float array, timestamps parsed in one vectorized pass"""
+        if not rows:
+            return np.empty((0, 6))
+        import pandas as pd
+        stamps = pd.to_datetime([r[0] for r in rows], format='ISO8601')
+        if stamps.tz is None:
+            stamps = stamps.tz_localize(IST)
+        bars = np.empty((len(rows), 6))
+        bars[:, 0] = (stamps - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+        bars[:, 1:] = [[float(v) for v in r[1:5]] + [float(r[5]) if len(r) > 5 else 0.0] for r in rows]
+        return bars[np.argsort(bars[:, 0], kind='stable')]
+    
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            bars = self._load(key)
+            entry = self._entries[key] = {
+                'bars': bars,
+                'fetched_from': bars[0, 0] if len(bars) else 0,
+                'fetched_to': bars[-1, 0] + CandleBuilder.INTERVALS[key[1]] if len(bars) else 0,
+                'saved': len(bars)
+            }
+            while len(self._entries) > self.capacity:
+                old = next(iter(self._entries))
+                self._persist(old)
+                del self._entries[old]
+        self._entries.move_to_end(key)
+        return entry
+    
+    def _path(self, key):
+        token, interval = key
+        return os.path.join(self.directory, f"{interval}_{token}.npy")
+    
+    def _load(self, key):
+        try:
+            return np.load(self._path(key))
+        except (OSError, ValueError):
+            return np.empty((0, 6))
+    
+    def _finished_before(self):
+        """Bars starting before this time belong to a closed session and won't change"""
+        now = datetime.now(IST)
+        close = now.replace(hour=self.SESSION_CLOSE[0], minute=self.SESSION_CLOSE[1], second=0, microsecond=0)
+        return (close if now >= close else now.replace(hour=0, minute=0, second=0, microsecond=0)).timestamp()
+    
+    def _persist(self, key):
+        entry = self._entries[key]
+        bars = entry['bars']
+        finished = int(np.searchsorted(bars[:, 0], self._finished_before(), 'left')) if len(bars) else 0
+        if finished <= entry['saved']:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self._path(key) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, bars[:finished])
+            os.replace(tmp, self._path(key))
+            entry['saved'] = finished
+        except OSError as e:
+            print(f"{Fore.YELLOW}⚠️ Could not persist candles for {key[0]}: {e}")
+
+# ============================================================================
+# BREAKOUT ENGINE
+# ============================================================================
+
+class BreakoutEngine:
+    """Instrument state in contiguous NumPy arrays - entry, stop-loss and trailing rules in one vectorized pass"""
+    FLOAT_FIELDS = ('ltp', 'level', 'entry', 'lot', 'pnl', 'high_pnl', 'trail_sl')
+    BOOL_FIELDS = ('traded', 'open', 'trailing')
+    
+    def __init__(self, capacity=16):
+        self.slots = {}
+        self.keys = []
+        self.size = 0
+        for field in self.FLOAT_FIELDS:
+            setattr(self, field, np.zeros(capacity))
+        for field in self.BOOL_FIELDS:
+            setattr(self, field, np.zeros(capacity, dtype=bool))
+        self.trail_sl[:] = np.nan
+    
+    def _grow(self):
+        for field in self.FLOAT_FIELDS + self.BOOL_FIELDS:
+            old = getattr(self, field)
+            new = np.full(len(old) * 2, np.nan) if field == 'trail_sl' else np.zeros(len(old) * 2, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, field, new)
+    
+    def add(self, key, level):
+        """Register an instrument (or move its breakout level) - returns its slot"""
+        if key in self.slots:
+            self.level[self.slots[key]] = level
+            return self.slots[key]
+        if self.size == len(self.ltp):
+            self._grow()
+        i = self.size
+        self.size += 1
+        self.slots[key] = i
+        self.keys.append(key)
+        self.level[i] = level
+        return i
+    
+    def open_trade(self, key, entry, lot):
+        i = self.slots[key]
+        self.entry[i], self.lot[i], self.pnl[i], self.high_pnl[i] = entry, lot, 0, 0
+        self.trail_sl[i] = np.nan
+        self.traded[i], self.open[i], self.trailing[i] = True, True, False
+    
+    def close_trade(self, key):
+        i = self.slots[key]
+        self.open[i] = self.trailing[i] = False
+    
+    def cancel_trade(self, key):
+        """Forget an entry whose order was rejected - the option can break out again"""
+        i = self.slots[key]
+        self.traded[i] = self.open[i] = self.trailing[i] = False
+    
+    def rebase_entry(self, key, entry):
+        self.entry[self.slots[key]] = entry
+    
+    def restore_trade(self, key, trade, high_pnl, trailing):
+        """Put a journaled trade back - open ones resume with their PnL high and trailing stop"""
+        self.open_trade(key, trade['entry'], trade['lot'])
+        i = self.slots[key]
+        self.pnl[i], self.high_pnl[i] = trade.get('pnl', 0), high_pnl
+        if trailing and trade.get('trailing_sl') is not None:
+            self.trailing[i], self.trail_sl[i] = True, trade['trailing_sl']
+        if trade.get('status') != 'open':
+            self.close_trade(key)
+    
+    def load_prices(self, instruments, prices):
+        """Latch this tick's LTPs - instruments not passed in are treated as having no price"""
+        self.ltp[:self.size] = 0
+        for inst in instruments:
+            i = self.slots.get(inst['key'])
+            if i is not None:
+                self.ltp[i] = prices.get(inst['key'], 0)
+    
+    def evaluate(self):
+        """Apply the rules to every slot - returns {action: slot indices} for the ones that need action"""
+        n = self.size
+        ltp, lot, pnl, high = self.ltp[:n], self.lot[:n], self.pnl[:n], self.high_pnl[:n]
+        trail_sl, trailing = self.trail_sl[:n], self.trailing[:n]
+        live = ltp > 0
+        
+        entries = live & ~self.open[:n] & ~self.traded[:n] & (ltp >= self.level[:n])
+        
+        held = live & self.open[:n]
+        np.copyto(pnl, (ltp - self.entry[:n]) * lot, where=held)
+        np.maximum(high, pnl, out=high, where=held)
+        
+        stops = held & (pnl <= -Config.STOP_LOSS_AMOUNT)
+        rest = held & ~stops
+        drawdown = np.divide(Config.TRAILING_STOP_DRAWDOWN, lot, out=np.full(n, np.inf), where=lot > 0)
+        new_sl = ltp - drawdown
+        
+        activated = rest & ~trailing & (pnl >= Config.TRAILING_PROFIT_TRIGGER)
+        np.copyto(trail_sl, new_sl, where=activated)
+        trailing |= activated
+        
+        active = rest & trailing
+        updated = active & (new_sl > trail_sl)
+        np.copyto(trail_sl, new_sl, where=updated)
+        trail_exits = active & (high - pnl >= Config.TRAILING_STOP_DRAWDOWN)
+        
+        return {
+            'entries': np.flatnonzero(entries),
+            'stops': np.flatnonzero(stops),
+            'trail_activated': np.flatnonzero(activated),
+            'trail_updated': np.flatnonzero(updated),
+            'trail_exits': np.flatnonzero(trail_exits),
+        }
+
+# ============================================================================
+# ORDER EXECUTION
+# ============================================================================
+
+class OrderWorker:
+    """Places orders off the tick loop - a submission queue, idempotency keys and fills confirmed by order-book polling"""
+    # Angel One orderstatus -> order state. Anything else (open, trigger pending, ...) is still working
+    STATUS = {'complete': 'filled', 'rejected': 'rejected', 'cancelled': 'rejected'}
+    
+    def __init__(self, client, threaded=True, poll_interval=Config.ORDER_POLL_INTERVAL):
+        self.client = client
+        self.threaded = threaded  # False places and confirms inline - backtests stay deterministic
+        self.poll_interval = poll_interval
+        self.orders = {}  # idempotency key -> order
+        self.polls = 0
+        self._queue = queue.Queue()
+        self._deferred = []  # exits waiting for their entry to fill
+        self._updates = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    @staticmethod
+    def tag(key):
+        """Broker-side ordertag for a key (Angel One allows 20 chars) - finds orders placed without an id back"""
+        return hashlib.sha1(f"{datetime.now(IST):%Y%m%d}:{key}".encode()).hexdigest()[:20]
+    
+    def _register(self, key, name, symbol, token, side, quantity, after=None):
+        """The order on record for key - (order, True) when it is new"""
+        with self._lock:
+            if key in self.orders:
+                return self.orders[key], False
+            order = self.orders[key] = {
+                'key': key, 'name': name, 'symbol': symbol, 'token': token, 'side': side, 'quantity': quantity,
+                'tag': self.tag(key), 'after': after, 'state': 'pending', 'orderid': None, 'price': 0,
+                'filled': 0, 'error': '', 'submitted': time.time(), 'attempts': 0, 'sent': None, 'settled': None
+            }
+            return order, True
+    
+    def submit(self, key, name, symbol, token, side, quantity, after=None):
+        """Queue an order once per key - a repeated key returns the order still in flight, a settled key is refused"""
+        order, new = self._register(key, name, symbol, token, side, quantity, after)
+        if not new:
+            if order['state'] in ('filled', 'rejected'):
+                raise ValueError(f"order {key} is already {order['state']} - a new signal needs a new key")
+            return order
+        
+        if not self.threaded:
+            self._place(order)
+            self._poll()
+            return order
+        
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="order-worker", daemon=True)
+            self._thread.start()
+        self._queue.put(key)
+        return order
+    
+    def updates(self):
+        """Order state changes since the last call - drained on the monitor's thread, which owns the trades"""
+        changes = []
+        while self._updates:
+            changes.append(self._updates.popleft())
+        return changes
+    
+    def in_flight(self):
+        with self._lock:
+            return [o for o in self.orders.values() if o['state'] in ('pending', 'working', 'retry')]
+    
+    def wait(self, timeout):
+        """Block until no order is pending or working (or timeout) - True if everything settled"""
+        deadline = time.time() + timeout
+        while self.in_flight() and time.time() < deadline:
+            time.sleep(0.05)
+        return not self.in_flight()
+    
+    def stop(self):
+        """Place whatever is queued and end the worker thread - a later submit starts a fresh one"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+    
+    def _run(self):
+        last_poll = 0
+        while True:
+            keys = []
+            try:
+                keys.append(self._queue.get(timeout=self.poll_interval))
+                while True:
+                    keys.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            
+            for key in keys:
+                if key is not None:
+                    self._place(self.orders[key])
+            if None in keys:
+                return
+            if time.time() - last_poll >= self.poll_interval:
+                last_poll = time.time()
+                try:
+                    self._poll()
+                except Exception as e:
+                    log.message(f"❌ Order book poll failed: {e}", Fore.RED, level='ERROR')
+    
+    def _place(self, order):
+        # The worker thread and flatten() can both reach an order - only one of them sends it
+        with self._lock:
+            if order.get('placing') or order['state'] not in ('pending', 'retry'):
+                return
+            order['placing'] = True
+        try:
+            self._send(order)
+        finally:
+            order['placing'] = False
+    
+    def _send(self, order):
+        # An exit never goes out before its entry has filled
+        after = self.orders.get(order['after'])
+        if after and after['state'] != 'filled':
+            if after['state'] == 'rejected':
+                order['retry_until'] = 0
+                self._set(order, 'rejected', f"entry {after['key']} was rejected")
+            else:
+                with self._lock:
+                    if order not in self._deferred:
+                        self._deferred.append(order)
+            return
+        
+        order['attempts'] += 1
+        try:
+            result = self.client.place_order(order['symbol'], order['token'], order['side'], order['quantity'],
+                                             tag=order['tag'])
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        if result['success']:
+            order['orderid'] = None if result['orderid'] == 'PENDING_VERIFICATION' else result['orderid']
+            order['sent'] = time.time()
+            # submitted is stamped on the tick that detected the signal - this is detection to broker ack
+            metrics.tick_to_order.labels(order['side']).observe(order['sent'] - order['submitted'])
+            self._set(order, 'working')
+        elif result.get('unconfirmed'):
+            # The order may be live - the order book, searched by tag, decides; it is never sent a second time
+            order['sent'] = time.time()
+            self._set(order, 'working', result.get('error', ''))
+        else:
+            self._set(order, 'rejected', result.get('error', ''))
+    
+    def _poll(self):
+        """One order-book call settles every working order - matched by order id, or by tag when the id is unknown"""
+        with self._lock:
+            working = [o for o in self.orders.values() if o['state'] == 'working']
+        if working:
+            self.polls += 1
+            book = self.client.fetch_order_book()
+            by_id = {str(o.get('orderid')): o for o in book}
+            by_tag = {o.get('ordertag'): o for o in book if o.get('ordertag')}
+            for order in working:
+                entry = by_id.get(str(order['orderid'])) or by_tag.get(order['tag'])
+                with self._lock:
+                    if order['state'] != 'working':
+                        continue  # settled by a concurrent poll
+                    if entry is None:
+                        # Missing from the book is not a broker rejection - the trade stays as booked, polling by
+                        # tag goes on, and someone is told to check the broker
+                        if (order['orderid'] is None and not order.get('unverified')
+                                and time.time() - order['submitted'] > Config.ORDER_VERIFY_TIMEOUT):
+                            order['unverified'] = True
+                            log.message(f"🚨 {order['side']} {order['quantity']} {order['symbol']} (tag {order['tag']}) not in "
+                                        f"the order book after {Config.ORDER_VERIFY_TIMEOUT}s - check it at the broker",
+                                        Fore.RED, level='ERROR')
+                        continue
+                    order['orderid'] = str(entry.get('orderid'))
+                    order['filled'] = int(float(entry.get('filledshares') or 0))
+                    state = self.STATUS.get(str(entry.get('orderstatus', '')).lower())
+                    if state:
+                        order['price'] = float(entry.get('averageprice') or 0)
+                        self._set(order, state, entry.get('text', '') if state == 'rejected' else '')
+        
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+        for order in deferred:
+            self._place(order)
+    
+    def _set(self, order, state, error=''):
+        now = time.time()
+        if state == 'rejected' and now < order.get('retry_until', 0):
+            # A flatten leg - flatten() sends it again after a backoff instead of giving up
+            order.update(state='retry', error=error,
+                         next_try=min(now + Config.FLATTEN_BACKOFF * 2 ** (order['attempts'] - 1), order['retry_until']))
+            return
+        order['state'] = state
+        order['error'] = error
+        if state in ('filled', 'rejected'):
+            order['settled'] = now
+        self._updates.append(dict(order))
+    
+    def flatten(self, legs, deadline=Config.FLATTEN_DEADLINE):
+        """Send every exit leg at once, retry failed legs with backoff until the deadline - returns the legs' orders"""
+        started = time.time()
+        until = started + deadline
+        orders = []
+        for leg in legs:
+            order, new = self._register(*leg)
+            if new or order['state'] in ('pending', 'working', 'retry'):
+                order['retry_until'] = until
+                orders.append(order)
+        if not orders:
+            return []
+        
+        workers = min(len(orders), Config.FLATTEN_WORKERS) if self.threaded else 1
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="flatten") as pool:
+            placing = {}
+            last_poll = 0
+            while True:
+                now = time.time()
+                waiting = []
+                for order in orders:
+                    entry = self.orders.get(order['after'])
+                    if order['state'] == 'pending' and entry and entry['state'] not in ('filled', 'rejected'):
+                        waiting.append(entry)   # sent once a poll settles its entry
+                        continue
+                    due = order['state'] == 'pending' or (order['state'] == 'retry' and now >= order['next_try'])
+                    if due and order['key'] not in placing:
+                        placing[order['key']] = pool.submit(self._place, order)
+                if not self.threaded:
+                    for future in placing.values():
+                        future.result()
+                placing = {key: f for key, f in placing.items() if not f.done()}
+                
+                if not placing and not any(o['state'] in ('pending', 'working', 'retry') for o in orders):
+                    break
+                if now >= until:
+                    break
+                if any(o['state'] == 'working' for o in orders + waiting) and now - last_poll >= self.poll_interval:
+                    last_poll = now
+                    self._poll()
+                    continue
+                time.sleep(0.02)
+        
+        for order in orders:
+            order['retry_until'] = 0
+            if order['state'] == 'retry':
+                self._set(order, 'rejected', order['error'])
+            elif order['state'] == 'pending':
+                # Never sent - its entry is still open at the broker; the worker sends it once the entry fills
+                order['error'] = f"not sent - entry {order['after']} still {self.orders[order['after']]['state']}"
+                self._place(order)
+        
+        for order in orders:
+            order['latency'] = (order['sent'] - started) * 1000 if order['sent'] else None
+            order['confirm'] = (order['settled'] - started) * 1000 if order['settled'] else None
+        return [dict(order) for order in orders]
+
 # ============================================================================
 # PARALLEL MONITORING SYSTEM
 # ============================================================================
 
 class ParallelMonitor:
-    def __init__(self, client, watchlist):
+    def __init__(self, client, watchlist, clock=None, publish=True, stream=None, journal=None, orders=None):
         self.client = client
         self.watchlist = watchlist
+        self.journal = journal
+        self.orders = orders or OrderWorker(client)
+        self.clock = clock or SystemClock()
+        self.publish = publish
+        self.stream = Config.FEED_MODE == "STREAM" if stream is None else stream
         self.trades = {}
         self.daily_pnl = {'total': 0, 'trades': []}
         self.breakout_levels = {}
         self.highest_pnl = {}
         self.trailing_active = {}
+        self.engine = BreakoutEngine()
+        self.candles = CandleBuilder((Config.CANDLE_INTERVAL,), on_close=self.on_candle_close)
+        self.token_legs = {}
+        self.ticks = 0
+        self._signals = itertools.count(1)  # numbers every order key - a re-fire within the same second is a new order
+        self.feed = None
+        self._rotations = deque()  # (stocks to add, symbols to remove) handed over by WatchlistRotator
         self.running = True
         
+        # Read the journal before this run starts appending to it
+        recovered = TradeJournal.recover(journal.path) if journal else None
+        
         # Initialize breakout levels
         for stock in watchlist:
+            self.register_stock(stock)
+        
+        if recovered:
+            self.restore(recovered)
+    
+    def register_stock(self, stock):
+        """Set up breakout levels and candle tracking for one watchlist stock"""
+        symbol = stock['symbol']
+        for leg in ('ce', 'pe'):
+            token = str(stock[f'{leg}_token'])
+            self.token_legs[token] = (stock, leg)
+            self.candles.seed(token, stock.get(f'{leg}_bars', []))
+        self.set_breakout_level(f"{symbol}_CE", stock['ce_high'] * 1.01, stock['ce_token'])
+        self.set_breakout_level(f"{symbol}_PE", stock['pe_high'] * 1.01, stock['pe_token'])
+        
+        print(Fore.CYAN + f"\n📊 {symbol}")
+        print(Fore.GREEN + f"   CE Breakout: ₹{self.breakout_levels[f'{symbol}_CE']:.2f}")
+        print(Fore.RED + f"   PE Breakout: ₹{self.breakout_levels[f'{symbol}_PE']:.2f}")
+        print(Fore.YELLOW + f"   Last Candle Time: {stock['candle_time']}")
+    
+    def add_stocks(self, stocks):
+        """Start watching stocks picked up by a rescan - the first tick after this evaluates them"""
+        watched = {stock['symbol'] for stock in self.watchlist}
+        added = []
+        for stock in stocks:
+            if stock['symbol'] not in watched:
+                self.watchlist.append(stock)
+                self.register_stock(stock)
+                added.append(stock['symbol'])
+        return added
+    
+    def remove_stocks(self, symbols):
+        """Stop watching stocks - any with an open or still-settling trade stay. Returns the dropped instruments"""
+        dropped = []
+        for stock in list(self.watchlist):
             symbol = stock['symbol']
-            self.breakout_levels[f"{symbol}_CE"] = stock['ce_high'] * 1.01
-            self.breakout_levels[f"{symbol}_PE"] = stock['pe_high'] * 1.01
-            
-            print(Fore.CYAN + f"\n📊 {symbol}")
-            print(Fore.GREEN + f"   CE Breakout: ₹{self.breakout_levels[f'{symbol}_CE']:.2f}")
-            print(Fore.RED + f"   PE Breakout: ₹{self.breakout_levels[f'{symbol}_PE']:.2f}")
-            print(Fore.YELLOW + f"   Last Candle Time: {stock['candle_time']}")
+            if symbol not in symbols:
+                continue
+            legs = [self.trades.get(f"{symbol}_{opt}") for opt in ('CE', 'PE')]
+            if any(t and (t.get('status') == 'open' or t.get('exit_state') in ('pending', 'working', 'retry')) for t in legs):
+                continue
+            self.watchlist.remove(stock)
+            for leg in ('ce', 'pe'):
+                token = str(stock[f'{leg}_token'])
+                self.token_legs.pop(token, None)
+                self.candles.drop(token)
+                dropped.append({'exchange': 'NFO', 'token': token, 'symbol': symbol})
+        return dropped
+    
+    def rotate(self, add, remove):
+        """Queue a watchlist change from another thread - applied between ticks by apply_rotations"""
+        self._rotations.append((add, remove))
+    
+    def apply_rotations(self):
+        changed = False
+        while self._rotations:
+            add, remove = self._rotations.popleft()
+            dropped = self.remove_stocks(remove)
+            added = self.add_stocks(add)
+            if self.feed and dropped:
+                self.feed.unsubscribe(dropped)
+            removed = sorted({inst['symbol'] for inst in dropped})
+            kept = sorted(set(remove) - set(removed))
+            print(Fore.CYAN + f"\n🔄 Watchlist rotated: +{', '.join(added) or '-'} | -{', '.join(removed) or '-'}" +
+                  (f" | kept (open trades): {', '.join(kept)}" if kept else ""))
+            changed = changed or bool(added or dropped)
+        if changed:
+            save_watchlist(self.watchlist)
+    
+    def restore(self, state):
+        """Resume today's trades from the journal - traded options are never re-entered"""
+        if not state['trades']:
+            return
+        
+        started = time.perf_counter()
+        watched = {stock['symbol'] for stock in self.watchlist}
+        for name, stock in state['stocks'].items():
+            # An open position must stay monitored even if today's rebuilt watchlist dropped its stock
+            if stock['symbol'] not in watched and state['trades'][name].get('status') == 'open':
+                self.watchlist.append(stock)
+                self.register_stock(stock)
+                watched.add(stock['symbol'])
+        
+        # A level belongs to the contract it was taken from - if the rebuilt watchlist picked another strike, keep its fresh one
+        tokens = {f"{stock['symbol']}_{leg.upper()}": str(stock[f'{leg}_token'])
+                  for stock in self.watchlist for leg in ('ce', 'pe')}
+        for name, (level, token) in state['levels'].items():
+            if name in self.breakout_levels and token == tokens.get(name):
+                self.set_breakout_level(name, level, token)
+        
+        for name, trade in state['trades'].items():
+            if name not in self.engine.slots:
+                continue
+            self.trades[name] = trade
+            self.highest_pnl[name] = state['highest_pnl'].get(name, 0)
+            self.trailing_active[name] = state['trailing_active'].get(name, False)
+            self.engine.restore_trade(name, trade, self.highest_pnl[name], self.trailing_active[name])
+        self.daily_pnl = state['daily_pnl']
+        
+        open_count = sum(1 for t in self.trades.values() if t.get('status') == 'open')
+        print(Fore.GREEN + f"\n♻️ Recovered {open_count} open / {len(self.trades) - open_count} closed trades "
+              f"from journal (P&L ₹{self.daily_pnl['total']:,.0f}, {(time.perf_counter() - started) * 1000:.1f}ms)")
+    
+    def set_breakout_level(self, key, level, token):
+        self.breakout_levels[key] = level
+        self.engine.add(key, level)
+        if self.journal:
+            self.journal.write('level', key, level=level, token=str(token))
+    
+    def on_candle_close(self, token, interval, candle):
+        """Roll an untraded option's breakout level forward to the candle that just closed"""
+        if not Config.ROLL_BREAKOUT_LEVELS or candle['partial'] or token not in self.token_legs:
+            return
+        stock, leg = self.token_legs[token]
+        key = f"{stock['symbol']}_{leg.upper()}"
+        if key in self.trades:
+            return
+        
+        stock[f'{leg}_high'] = candle['high']
+        stock['candle_time'] = candle['timestamp']
+        self.set_breakout_level(key, candle['high'] * 1.01, token)
+        log.info('candle', key=key, time=candle['timestamp'], high=candle['high'], breakout=self.breakout_levels[key],
+                 is_ce=leg == 'ce')
+    
+    def update_candles(self, instruments, prices, now):
+        for inst in instruments:
+            self.candles.update(str(inst['token']), prices.get(inst['key'], 0), now)
+        self.candles.flush(now)
     
     def get_all_instruments(self):
         """Build list of all instruments to monitor"""
@@ -620,18 +3252,10 @@ class ParallelMonitor:
         opt_type = "CE" if is_ce else "PE"
         name = f"{stock['symbol']}_{opt_type}"
         
-        print((Fore.GREEN if is_ce else Fore.RED) + f"\n🚀 {name} BREAKOUT @ ₹{ltp:.2f} | Time: {datetime.now().strftime('%H:%M:%S')}")
-        
-        order_result = self.client.place_order(
-            symbol=stock['ce_symbol'] if is_ce else stock['pe_symbol'],
-            token=stock['ce_token'] if is_ce else stock['pe_token'],
-            transaction_type="BUY",
-            quantity=stock['lot']
-        )
-        
-        if not order_result['success']:
-            return False
+        log.info('breakout', key=name, ltp=ltp, is_ce=is_ce, time=self.clock.now().strftime('%H:%M:%S'))
         
+        # The order goes to the order worker - the trade is tracked from the signal and settled by apply_order_updates
+        order_key = self.order_key(name, "BUY")
         self.trades[name] = {
             'token': stock['ce_token'] if is_ce else stock['pe_token'],
             'lot': stock['lot'],
@@ -645,58 +3269,132 @@ class ParallelMonitor:
             'strike': stock['atm'],
             'status': 'open',
             'pnl': 0,
-            'entry_time': datetime.now().strftime('%H:%M:%S'),
-            'order_id': order_result['orderid'],
+            'entry_time': self.clock.now().strftime('%H:%M:%S'),
+            'order_id': None,
+            'order_key': order_key,
+            'order_state': 'pending',
             'mode': Config.MODE,
             'strategy': 'Long Build Up - 3-Min Breakout'
         }
         
         self.highest_pnl[name] = 0
         self.trailing_active[name] = False
+        self.engine.open_trade(name, ltp, stock['lot'])
+        if self.journal:
+            self.journal.write('entry', name, trade=dict(self.trades[name]),
+                               stock={k: v for k, v in stock.items() if not k.endswith('_bars')})
         
+        trade = self.trades[name]
+        self.orders.submit(order_key, name, trade['tradingsymbol'], trade['token'], "BUY", trade['lot'])
         return True
     
-    def execute_exit(self, trade, name, ltp, pnl, reason):
-        """Execute exit order"""
+    def execute_exit(self, trade, name, ltp, pnl, reason, send=True):
+        """Execute exit order - send=False books the exit and leaves the SELL to the caller (close_all_positions)"""
         is_ce = trade['type'] == 'CE'
-        color = Fore.GREEN if is_ce else Fore.RED
-        
-        print(color + f"\n🛑 {reason} - {name} @ ₹{ltp:.2f} | Time: {datetime.now().strftime('%H:%M:%S')}")
-        
-        exit_order = self.client.place_order(
-            symbol=trade['tradingsymbol'],
-            token=trade['token'],
-            transaction_type="SELL",
-            quantity=trade['lot']
-        )
-        
-        if not exit_order['success']:
-            return False
+        log.info('exit', key=name, reason=reason, ltp=ltp, is_ce=is_ce, time=self.clock.now().strftime('%H:%M:%S'))
         
+        # Booked at the signal price now, re-priced (or reopened) once the order worker settles the SELL
+        exit_key = self.order_key(name, "SELL")
         trade.update({
             'status': 'closed',
             'exit': ltp,
             'pnl': pnl,
-            'exit_time': datetime.now().strftime('%H:%M:%S'),
+            'exit_time': self.clock.now().strftime('%H:%M:%S'),
             'exit_reason': reason,
-            'exit_order_id': exit_order['orderid']
+            'exit_order_id': None,
+            'exit_key': exit_key,
+            'exit_state': 'pending'
         })
         
         self.daily_pnl['total'] += pnl
         self.daily_pnl['trades'].append(trade)
+        self.engine.close_trade(name)
+        if self.journal:
+            self.journal.write('exit', name, fields={k: trade[k] for k in (
+                'status', 'exit', 'pnl', 'exit_time', 'exit_reason', 'exit_order_id', 'exit_key', 'exit_state', 'ltp')})
         
-        print(color + f"P&L: ₹{pnl:,.0f} | Daily: ₹{self.daily_pnl['total']:,.0f}")
+        log.info('exit_pnl', key=name, pnl=pnl, day_pnl=self.daily_pnl['total'], is_ce=is_ce)
         
+        if send:
+            self.orders.submit(*self.exit_leg(name, trade))
         return True
     
+    def order_key(self, name, side):
+        return f"{name}:{side}:{self.clock.now().strftime('%H%M%S')}:{next(self._signals)}"
+    
+    @staticmethod
+    def exit_leg(name, trade):
+        return (trade['exit_key'], name, trade['tradingsymbol'], trade['token'], "SELL", trade['lot'], trade.get('order_key'))
+    
+    def apply_order_updates(self):
+        """Fold order-worker results into the trades - fills re-price, a rejected entry is dropped, a rejected exit reopens"""
+        for order in self.orders.updates():
+            name, state, price = order['name'], order['state'], order['price']
+            trade = self.trades.get(name)
+            if trade is None:
+                continue
+            fields, pnl_change, event = {}, 0, {}
+            
+            if order['side'] == "BUY" and order['key'] == trade.get('order_key'):
+                fields = {'order_state': state, 'order_id': order['orderid']}
+                if state == 'filled' and price:
+                    fields.update(entry=price, stop_loss=price - Config.STOP_LOSS_AMOUNT / trade['lot'])
+                    if trade['status'] == 'open':
+                        self.engine.rebase_entry(name, price)
+                    else:
+                        pnl_change = (trade['entry'] - price) * trade['lot']
+                        fields['pnl'] = trade['pnl'] + pnl_change
+                elif state == 'rejected':
+                    # Never held - forget the trade (and any exit already booked against it)
+                    if trade['status'] == 'closed':
+                        pnl_change = -trade['pnl']
+                    del self.trades[name]
+                    self.highest_pnl.pop(name, None)
+                    self.trailing_active.pop(name, None)
+                    self.engine.cancel_trade(name)
+                    event = {'drop': True}
+            
+            elif order['side'] == "SELL" and order['key'] == trade.get('exit_key'):
+                fields = {'exit_state': state, 'exit_order_id': order['orderid']}
+                if state == 'filled' and price:
+                    pnl_change = (price - trade['exit']) * trade['lot']
+                    fields.update(exit=price, pnl=trade['pnl'] + pnl_change)
+                elif state == 'rejected':
+                    # Still holding the position - back to open, the next tick re-checks its exit rules
+                    pnl_change = -trade['pnl']
+                    fields.update(status='open', exit=None, exit_time=None, exit_reason=None, exit_key=None)
+                    event = {'reopen': True}
+            else:
+                continue  # superseded order
+            
+            if event:
+                self.daily_pnl['trades'] = [t for t in self.daily_pnl['trades'] if t is not trade]
+            if not event.get('drop'):
+                trade.update(fields)
+            self.daily_pnl['total'] += pnl_change
+            if event.get('reopen'):
+                self.engine.restore_trade(name, trade, self.highest_pnl.get(name, 0), self.trailing_active.get(name, False))
+            if self.journal and state != 'pending':
+                self.journal.write('order', name, fields=fields, pnl=pnl_change, **event)
+            if state in ('filled', 'rejected'):
+                log.info('order', key=name, side=order['side'], state=state, price=price, error=order['error'])
+    
     def process_tick(self, instruments, prices):
         """Process a single tick for all instruments"""
-        now = datetime.now().strftime('%H:%M:%S')
+        now = self.clock.now().strftime('%H:%M:%S')
         
-        # Print header
-        print(Fore.CYAN + f"\n{'='*100}")
-        print(Fore.YELLOW + f"⏰ TICK @ {now}")
-        print(Fore.CYAN + f"{'='*100}")
+        # Evaluate every rule for every instrument in one pass, then act on the flagged slots
+        engine = self.engine
+        engine.load_prices(instruments, prices)
+        actions = {name: {engine.keys[i] for i in slots} for name, slots in engine.evaluate().items()}
+        
+        # Tick output is queued to the log pipeline - full detail, or one summary line per tick
+        self.ticks += 1
+        detail = Config.TICK_LOG == "FULL" and self.ticks % Config.TICK_LOG_EVERY == 0
+        summary = Config.TICK_LOG != "OFF" and not detail
+        if detail:
+            log.info('tick', time=now)
+        watching = above = 0
         
         # Track breakout checks
         for inst in instruments:
@@ -709,26 +3407,20 @@ class ParallelMonitor:
             if ltp <= 0:
                 continue
             
-            stock = inst['stock']
             is_ce = inst['is_ce']
-            name = key
             breakout_level = self.breakout_levels[key]
-            
-            color = Fore.GREEN if is_ce else Fore.RED
-            opt_type = "CE" if is_ce else "PE"
-            
-            # Print current price vs breakout
-            status = "🔥 ABOVE" if ltp >= breakout_level else "⏳ BELOW"
-            print(color + f"{name:<15} | LTP: ₹{ltp:7.2f} | Breakout: ₹{breakout_level:7.2f} | {status}")
+            watching += 1
+            above += ltp >= breakout_level
+            if detail:
+                log.info('watch', key=key, ltp=ltp, breakout=breakout_level, is_ce=is_ce)
             
             # Check breakout
-            if ltp >= breakout_level and key not in self.trades:
-                self.execute_breakout(stock, is_ce, ltp)
+            if key in actions['entries']:
+                self.execute_breakout(inst['stock'], is_ce, ltp)
         
         # Track open trades
-        print(Fore.CYAN + f"\n{'-'*100}")
-        print(Fore.YELLOW + "📊 OPEN POSITIONS:")
-        print(Fore.CYAN + f"{'-'*100}")
+        if detail:
+            log.info('positions')
         
         for inst in instruments:
             if not inst.get('is_trade'):
@@ -741,78 +3433,92 @@ class ParallelMonitor:
             if ltp <= 0:
                 continue
             
+            i = engine.slots[key]
+            pnl = float(engine.pnl[i])
             trade['ltp'] = ltp
-            pnl = (ltp - trade['entry']) * trade['lot']
             trade['pnl'] = pnl
+            self.highest_pnl[key] = float(engine.high_pnl[i])
             
-            # Update highest PnL
-            if pnl > self.highest_pnl[key]:
-                self.highest_pnl[key] = pnl
-            
-            # Print position status
-            is_ce = trade['type'] == 'CE'
-            color = Fore.GREEN if is_ce else Fore.RED
-            pnl_color = Fore.GREEN if pnl > 0 else Fore.RED
-            
-            print(color + f"{key:<15} | Entry: ₹{trade['entry']:7.2f} | LTP: ₹{ltp:7.2f} | " + 
-                  pnl_color + f"PnL: ₹{pnl:8,.0f} " + 
-                  Fore.CYAN + f"| SL: ₹{trade['stop_loss']:.2f}")
+            if detail:
+                log.info('position', key=key, entry=trade['entry'], ltp=ltp, pnl=pnl,
+                         sl=trade['stop_loss'], is_ce=trade['type'] == 'CE')
             
             # Check stop loss
-            if pnl <= -Config.STOP_LOSS_AMOUNT:
+            if key in actions['stops']:
                 self.execute_exit(trade, key, ltp, pnl, 'Stop Loss')
                 continue
             
             # Activate trailing stop
-            if pnl >= Config.TRAILING_PROFIT_TRIGGER and not self.trailing_active[key]:
+            if key in actions['trail_activated']:
                 self.trailing_active[key] = True
-                trade['trailing_sl'] = ltp - (Config.TRAILING_STOP_DRAWDOWN / trade['lot'])
-                print(Fore.CYAN + f"   🎯 Trailing Stop Activated @ ₹{trade['trailing_sl']:.2f}")
+                trade['trailing_sl'] = float(engine.trail_sl[i])
+                log.info('trail_on', key=key, sl=trade['trailing_sl'])
             
             # Update trailing stop
-            if self.trailing_active[key]:
-                new_trailing_sl = ltp - (Config.TRAILING_STOP_DRAWDOWN / trade['lot'])
-                if new_trailing_sl > trade.get('trailing_sl', 0):
-                    trade['trailing_sl'] = new_trailing_sl
-                    print(Fore.CYAN + f"   📈 Trailing Stop Updated @ ₹{trade['trailing_sl']:.2f}")
+            if key in actions['trail_updated']:
+                trade['trailing_sl'] = float(engine.trail_sl[i])
+                log.info('trail_up', key=key, sl=trade['trailing_sl'])
+            
+            if self.journal and (key in actions['trail_activated'] or key in actions['trail_updated']):
+                self.journal.write('trail', key, trailing_sl=trade['trailing_sl'], high_pnl=self.highest_pnl[key])
             
             # Check trailing stop
-            if self.trailing_active[key] and (self.highest_pnl[key] - pnl) >= Config.TRAILING_STOP_DRAWDOWN:
+            if key in actions['trail_exits']:
                 self.execute_exit(trade, key, ltp, pnl, 'Trailing Stop')
         
-        print(Fore.CYAN + f"{'='*100}\n")
+        if detail:
+            log.info('tick_end')
+        elif summary:
+            open_trades = [t for t in self.trades.values() if t.get('status') == 'open']
+            log.info('tick_summary', time=now, watching=watching, above=int(above), open=len(open_trades),
+                     open_pnl=sum(t['pnl'] for t in open_trades), day_pnl=self.daily_pnl['total'])
     
     def close_all_positions(self, reason="Auto-Exit"):
         """Close all open positions at market price"""
         print(Fore.YELLOW + f"\n{'='*100}")
-        print(Fore.YELLOW + f"⏰ {reason} - CLOSING ALL POSITIONS @ {datetime.now().strftime('%H:%M:%S')}")
+        print(Fore.YELLOW + f"⏰ {reason} - CLOSING ALL POSITIONS @ {self.clock.now().strftime('%H:%M:%S')}")
         print(Fore.YELLOW + f"{'='*100}\n")
         
-        instruments = self.get_all_instruments()
-        prices = self.client.get_ltp_batch(instruments)
-        
-        closed_count = 0
-        for inst in instruments:
-            if not inst.get('is_trade'):
+        # Book every exit at the last tick (fills re-price them), then send all SELLs at once
+        legs = []
+        for key, trade in list(self.trades.items()):
+            if trade.get('status') != 'open':
                 continue
-            
-            key = inst['key']
-            trade = inst['trade']
-            ltp = prices.get(key, 0)
-            
-            if ltp <= 0:
-                ltp = trade.get('ltp', trade['entry'])
-            
-            pnl = (ltp - trade['entry']) * trade['lot']
-            
-            if self.execute_exit(trade, key, ltp, pnl, reason):
-                closed_count += 1
-        
-        print(Fore.GREEN + f"\n✅ Closed {closed_count} positions")
+            ltp = trade.get('ltp') or trade['entry']
+            if self.execute_exit(trade, key, ltp, (ltp - trade['entry']) * trade['lot'], reason, send=False):
+                legs.append(self.exit_leg(key, trade))
+        
+        report = self.orders.flatten(legs, Config.FLATTEN_DEADLINE)
+        self.apply_order_updates()
+        log.flush()
+        
+        for order in report:
+            color = Fore.GREEN if order['state'] == 'filled' else Fore.YELLOW if order['state'] == 'working' else Fore.RED
+            state = 'NOT SENT' if order['state'] == 'pending' else order['state'].upper()
+            sent = f"{order['latency']:,.0f}ms" if order['latency'] is not None else "-"
+            confirmed = f"{order['confirm']:,.0f}ms" if order['confirm'] is not None else "-"
+            print(color + f"{order['name']:<15} | {state:<8} | sent {sent:>8} | confirmed {confirmed:>8} | "
+                  f"attempts {order['attempts']}" + (f" | {order['error']}" if order['error'] else ""))
+        
+        closed_count = sum(1 for order in report if order['state'] == 'filled')
+        sent = [order['latency'] for order in report if order['latency'] is not None]
+        print(Fore.GREEN + f"\n✅ Closed {closed_count}/{len(report)} positions" +
+              (f" - all sent within {max(sent):,.0f}ms" if sent else ""))
         return closed_count
     
-    async def update_websocket(self):
-        """Update WebSocket data"""
+    def journal_snapshot(self):
+        positions = {name: (t['ltp'], t['pnl'], self.highest_pnl.get(name, 0))
+                     for name, t in self.trades.items() if t.get('status') == 'open'}
+        if positions:
+            self.journal.write('pnl', positions=positions)
+    
+    def update_websocket(self):
+        """Update WebSocket data - nothing is built while no dashboard is connected"""
+        if ws.clients:
+            ws.publish(self.dashboard_state())
+    
+    def dashboard_state(self):
+        """What the dashboard shows - built fresh, so the server loop can diff it while the trades move on"""
         closed_pnl = sum(t['pnl'] for t in self.trades.values() if t.get('status') == 'closed')
         open_pnl = sum(t['pnl'] for t in self.trades.values() if t.get('status') == 'open')
         
@@ -844,8 +3550,8 @@ class ParallelMonitor:
                 'candle_time': stock['candle_time']
             }
         
-        ws.data = {
-            'trades': self.trades,
+        return {
+            'trades': {name: dict(trade) for name, trade in self.trades.items()},
             'buildup_stocks': [s['symbol'] for s in self.watchlist],
             'total_pnl': closed_pnl,
             'unrealized_pnl': open_pnl,
@@ -858,12 +3564,10 @@ class ParallelMonitor:
             'mode': Config.MODE,
             'is_live_trading': Config.MODE == "LIVE",
             'connected': True,
-            'last_update': datetime.now().strftime('%H:%M:%S'),
+            'last_update': self.clock.now().strftime('%H:%M:%S'),
             'live_prices': live_prices,
             'breakout_status': breakout_status
         }
-        
-        await ws.broadcast(ws.data)
     
     def start(self):
         """Start parallel monitoring"""
@@ -873,13 +3577,27 @@ class ParallelMonitor:
         
         tick_count = 0
         auto_exit_triggered = False
+        last_publish = 0
+        clock = self.clock
+        last_snapshot = clock.time()
+        feed = self.feed = self.client.start_feed() if self.stream else None
+        
+        last_tick = None
         
         try:
-            while is_open() and self.running:
+            while is_open(clock.now()) and self.running:
                 tick_count += 1
+                tick_started = clock.time()
+                if last_tick is not None:
+                    metrics.tick_drift.observe(tick_started - last_tick - Config.TICK_INTERVAL)
+                last_tick = None
+                
+                # Settle whatever the order worker confirmed since the last tick, then any watchlist rotation
+                self.apply_order_updates()
+                self.apply_rotations()
                 
                 # Check for auto-exit time (3:15 PM)
-                if should_auto_exit() and not auto_exit_triggered:
+                if should_auto_exit(clock.now()) and not auto_exit_triggered:
                     auto_exit_triggered = True
                     self.close_all_positions(f"Auto-Exit @ {Config.AUTO_EXIT_TIME}")
                     print(Fore.CYAN + "\n✅ All positions closed at scheduled time")
@@ -888,6 +3606,7 @@ class ParallelMonitor:
                 # Check daily loss limit
                 if self.daily_pnl['total'] <= -Config.MAX_DAILY_LOSS:
                     print(Fore.RED + f"\n🛑 DAILY LOSS LIMIT REACHED: ₹{self.daily_pnl['total']:,.0f}")
+                    self.close_all_positions("Daily Loss Limit")
                     break
                 
                 # Check max trades
@@ -902,17 +3621,34 @@ class ParallelMonitor:
                     print(Fore.YELLOW + "✅ All positions closed")
                     break
                 
-                # Fetch all prices at once
-                prices = self.client.get_ltp_batch(instruments)
+                # Streaming: every price update wakes the loop. Polling (or feed down): one batch per tick
+                if feed:
+                    feed.subscribe(instruments)
+                streaming = feed is not None and feed.connected
+                if streaming:
+                    prices = feed.wait_prices(instruments, Config.TICK_INTERVAL)
+                else:
+                    prices = self.client.get_ltp_batch(instruments)
                 
-                # Process this tick
+                # Process this tick, then roll candles (a candle close re-levels from the next tick on)
+                started = time.perf_counter()
                 self.process_tick(instruments, prices)
+                metrics.process_tick.observe(time.perf_counter() - started)
+                self.update_candles(instruments, prices, clock.time())
                 
-                # Update WebSocket
-                asyncio.run(self.update_websocket())
+                if self.journal and clock.time() - last_snapshot >= Config.JOURNAL_SNAPSHOT:
+                    last_snapshot = clock.time()
+                    self.journal_snapshot()
                 
-                # Sleep before next tick
-                time.sleep(Config.TICK_INTERVAL)
+                # Update WebSocket - dashboard refresh stays on the TICK_INTERVAL cadence
+                if self.publish and clock.time() - last_publish >= Config.TICK_INTERVAL:
+                    last_publish = clock.time()
+                    self.update_websocket()
+                
+                # Sleep before next tick - drift is only measured across polling ticks, a streamed tick has no cadence
+                if not streaming:
+                    last_tick = tick_started
+                    clock.sleep(Config.TICK_INTERVAL)
         
         except KeyboardInterrupt:
             print(Fore.YELLOW + "\n⚠️ Monitoring stopped by user")
@@ -923,6 +3659,20 @@ class ParallelMonitor:
         
         finally:
             self.running = False
+            if feed:
+                feed.stop()
+            if getattr(self.client, 'recorder', None):
+                self.client.recorder.close()
+            if hasattr(self.client, 'candle_cache'):
+                self.client.candle_cache.save()
+            if not self.orders.wait(Config.ORDER_WAIT):
+                print(Fore.RED + f"⚠️ {len(self.orders.in_flight())} orders still in flight at shutdown")
+            self.apply_order_updates()
+            self.orders.stop()
+            if self.journal:
+                self.journal_snapshot()
+                self.journal.close()
+            log.flush()
             
             # Final summary
             print(Fore.CYAN + f"\n{'='*100}")
@@ -933,16 +3683,311 @@ class ParallelMonitor:
             print(Fore.YELLOW + f"Total Trades: {len(self.daily_pnl['trades'])}")
             print(Fore.YELLOW + f"Open Positions: {len([t for t in self.trades.values() if t.get('status') == 'open'])}")
             print(Fore.YELLOW + f"Closed Positions: {len(self.daily_pnl['trades'])}")
+            if hasattr(self.client, 'scheduler'):
+                print(Fore.YELLOW + f"Broker Calls: {self.client.scheduler.summary()}")
             
             pnl_color = Fore.GREEN if self.daily_pnl['total'] > 0 else Fore.RED
             print(pnl_color + f"Total P&L: ₹{self.daily_pnl['total']:,.0f}")
             print(Fore.CYAN + f"{'='*100}\n")
 
+# ============================================================================
+# BACKTESTING
+# ============================================================================
+
+class TickSeries:
+    """Time-sorted (epoch seconds, ltp) arrays for one token"""
+    def __init__(self, times, prices):
+        self.times = np.asarray(times, dtype='float64')
+        self.prices = np.asarray(prices, dtype='float64')
+    
+    def at(self, ts):
+        i = np.searchsorted(self.times, ts, 'right') - 1
+        return float(self.prices[i]) if i >= 0 else 0
+
+class SimOrderClient:
+    """Stands in for AngelClient in backtests - quotes ticks at the sim clock's time and fills every order"""
+    def __init__(self, series, clock):
+        self.series = series
+        self.clock = clock
+        self.orders = []
+    
+    def ltp(self, token):
+        series = self.series.get(str(token))
+        return series.at(self.clock.time()) if series else 0
+    
+    def get_ltp_batch(self, instruments):
+        return {inst['key']: self.ltp(inst['token']) for inst in instruments}
+    
+    def place_order(self, symbol, token, transaction_type, quantity, order_type="MARKET", price=0, tag=None):
+        order_id = f"SIM_{len(self.orders) + 1}"
+        fill = self.ltp(token) or price
+        self.orders.append({'orderid': order_id, 'tradingsymbol': symbol, 'transactiontype': transaction_type,
+                            'quantity': quantity, 'price': fill, 'averageprice': fill, 'filledshares': quantity,
+                            'time': self.clock.now().strftime('%H:%M:%S'), 'orderstatus': 'complete',
+                            'ordertag': tag or ''})
+        return {'success': True, 'orderid': order_id, 'data': {
+            'orderid': order_id, 'mode': 'BACKTEST', 'price': fill, 'quantity': quantity, 'symbol': symbol}}
+    
+    def get_order_book(self):
+        return list(self.orders)
+    
+    fetch_order_book = get_order_book
+
+def load_ticks(path):
+    """Load a recorder .bin file or a `timestamp,token,ltp` CSV (epoch seconds or IST timestamps) into {token: TickSeries}"""
+    if path.endswith('.bin'):
+        ticks = TickFile(path)
+        return {str(token): TickSeries(*ticks.series(token)) for token in ticks.tokens()}
+    import pandas as pd
+    df = pd.read_csv(path, dtype={'token': str})
+    ts = pd.to_numeric(df['timestamp'], errors='coerce')
+    if ts.isna().any():
+        stamps = pd.to_datetime(df['timestamp'])
+        if stamps.dt.tz is None:
+            stamps = stamps.dt.tz_localize('Asia/Kolkata')
+        ts = (stamps - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+    df = df.assign(ts=ts).sort_values('ts', kind='stable')
+    return {token: TickSeries(g['ts'], g['ltp']) for token, g in df.groupby('token')}
+
+def synthetic_watchlist(n_stocks=2, seed=None):
+    rng = np.random.default_rng(seed)
+    watchlist = []
+    for n in range(n_stocks):
+        symbol = f"SYN{n + 1}"
+        ce_high, pe_high = rng.uniform(15, 60, 2).round(2)
+        watchlist.append({
+            "symbol": symbol, "spot": 1000.0, "atm": 1000, "lot": int(rng.choice([250, 500, 1000])), "expiry": "SYNTH",
+            "ce_token": str(900000 + 2 * n), "pe_token": str(900001 + 2 * n),
+            "ce_symbol": f"{symbol}1000CE", "pe_symbol": f"{symbol}1000PE",
+            "ce_ltp": ce_high, "pe_ltp": pe_high, "candle_time": "09:18:00",
+            "ce_high": ce_high, "pe_high": pe_high
+        })
+    return watchlist
+
+def synthetic_ticks(watchlist, day, seed=None, step=1.0, volatility=0.002):
+    """Random-walk option prices for every watchlist token, one tick per `step` seconds from 9:15 to 15:30 IST"""
+    rng = np.random.default_rng(seed)
+    start = datetime.combine(day, datetime.min.time(), tzinfo=IST).replace(hour=9, minute=15)
+    times = start.timestamp() + np.arange(0, 6.25 * 3600, step)
+    series = {}
+    for stock in watchlist:
+        for leg in ('ce', 'pe'):
+            walk = np.exp(np.cumsum(rng.normal(0, volatility, len(times))))
+            prices = np.maximum(0.05, np.round(stock[f'{leg}_high'] * 0.98 * walk / 0.05) * 0.05)
+            series[str(stock[f'{leg}_token'])] = TickSeries(times, prices)
+    return series
+
+def run_backtest(watchlist, series, day, verbose=False):
+    """Drive the real ParallelMonitor through one session on a simulated clock - returns the monitor"""
+    import copy, io, contextlib
+    start = datetime.combine(day, datetime.min.time(), tzinfo=IST).replace(hour=9, minute=15)
+    clock = SimClock(start)
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with out:
+        client = SimOrderClient(series, clock)
+        monitor = ParallelMonitor(client, copy.deepcopy(watchlist), clock=clock, publish=False, stream=False,
+                                  orders=OrderWorker(client, threaded=False))
+        monitor.start()
+        log.flush()
+    return monitor
+
+def run_backtest_cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="b.py backtest", description="Replay a session through ParallelMonitor")
+    parser.add_argument("--ticks", help="Recorded ticks_YYYYMMDD.bin or CSV of timestamp,token,ltp rows (default: synthetic random walk)")
+    parser.add_argument("--watchlist", help="Watchlist JSON saved by a live run (default: synthetic)")
+    parser.add_argument("--date", help="Session date YYYY-MM-DD (default: last weekday)")
+    parser.add_argument("--stocks", type=int, default=Config.MAX_STOCKS_TO_TRADE, help="Synthetic watchlist size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show the monitor's tick output")
+    args = parser.parse_args(argv)
+    log.directory = None  # replayed sessions stay out of the live day log
+    log.console = args.verbose
+    
+    if args.date:
+        day = datetime.strptime(args.date, '%Y-%m-%d').date()
+    else:
+        day = datetime.now().date()
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+    
+    if args.watchlist:
+        with open(args.watchlist) as f:
+            watchlist = json.load(f)
+    else:
+        watchlist = synthetic_watchlist(args.stocks, args.seed)
+    series = load_ticks(args.ticks) if args.ticks else synthetic_ticks(watchlist, day, args.seed)
+    
+    started = time.perf_counter()
+    monitor = run_backtest(watchlist, series, day, args.verbose)
+    elapsed = time.perf_counter() - started
+    
+    trades = list(monitor.trades.items())
+    print(Fore.CYAN + f"\n{'='*100}\n📼 BACKTEST {day} | {len(watchlist)} stocks | {len(trades)} trades\n{'='*100}")
+    for name, t in trades:
+        pnl_color = Fore.GREEN if t['pnl'] > 0 else Fore.RED
+        print(Fore.YELLOW + f"{name:<15} | {t['entry_time']} → {t.get('exit_time', '-'):<8} | "
+              f"Entry: ₹{t['entry']:7.2f} | Exit: ₹{t.get('exit', t['ltp']):7.2f} | "
+              + pnl_color + f"PnL: ₹{t['pnl']:8,.0f} " + Fore.CYAN + f"| {t.get('exit_reason', t['status'])}")
+    pnl_color = Fore.GREEN if monitor.daily_pnl['total'] > 0 else Fore.RED
+    print(pnl_color + f"Total P&L: ₹{monitor.daily_pnl['total']:,.0f}")
+    instrument_days = 2 * len(watchlist)
+    print(Fore.CYAN + f"⏱️ {elapsed * 1000:,.0f}ms ({elapsed * 1000 / max(instrument_days, 1):,.1f}ms per instrument-day)")
+    return monitor
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def save_watchlist(watchlist):
+    """Keep the day's watchlist next to the other session data so the day can be backtested later"""
+    try:
+        os.makedirs(Config.DATA_DIR, exist_ok=True)
+        path = os.path.join(Config.DATA_DIR, f"watchlist_{datetime.now().strftime('%Y%m%d')}.json")
+        with open(path, 'w') as f:
+            json.dump(watchlist, f, indent=2)
+    except OSError as e:
+        print(Fore.YELLOW + f"⚠️ Could not save watchlist: {e}")
+
+def run_session(client, scanner):
+    """One trading session on a logged-in client - scan, build the watchlist and run the monitor until the day ends"""
+    started = time.perf_counter()
+    
+    # Fetch Long Build Up stocks - the scanner keeps its warm session for intraday rescans
+    buildup_stocks = fetch_long_buildup_from_nse(scanner)
+    ws.publish({
+        'buildup_stocks': copy_state(buildup_stocks),
+        'mode': Config.MODE,
+        'connected': True
+    })
+    
+    if not buildup_stocks:
+        print(Fore.RED + "❌ No stocks to trade")
+        return None
+    
+    if not is_open():
+        print(Fore.RED + "❌ Market closed")
+        return None
+    
+    expiry = get_expiry(client._load_scrip_master())
+    print(Fore.CYAN + f"📅 Expiry: {expiry}\n")
+    
+    # Get ATM data for all stocks
+    watchlist = build_watchlist(client, buildup_stocks, expiry)
+    
+    if not watchlist:
+        print(Fore.RED + "❌ No options data available")
+        return None
+    
+    print(Fore.GREEN + f"\n✅ Watchlist ready with {len(watchlist)} stocks\n")
+    save_watchlist(watchlist)
+    
+    # Start parallel monitoring - today's journal (if any) is replayed first so a restart resumes its trades
+    journal = TradeJournal(TradeJournal.today_path()) if Config.LOG_TRADES else None
+    monitor = ParallelMonitor(client, watchlist, journal=journal)
+    rotator = WatchlistRotator(monitor, client, expiry, scanner).start() if Config.RESCAN_INTERVAL else None
+    ready = (time.perf_counter() - started) * 1000
+    ws.status['session_start_ms'] = round(ready)
+    print(Fore.CYAN + f"⏱️ Session ready in {ready:,.0f}ms - monitoring starts now")
+    monitor.start()
+    if rotator:
+        rotator.stop()
+    
+    # Show order book if live trading
+    if Config.MODE == "LIVE":
+        client.get_order_book()
+    return monitor
+
+def next_session(now):
+    """When the daemon should start trading - right away inside today's window, else DAEMON_START on the next weekday"""
+    hour, minute = map(int, Config.DAEMON_START.split(':'))
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if start <= now:
+        if now.weekday() < 5 and is_open(now) and not should_auto_exit(now):
+            return now
+        start += timedelta(days=1)
+    while start.weekday() >= 5:
+        start += timedelta(days=1)
+    return start
+
+def sleep_until(clock, when):
+    """Sleep in short steps so a suspended host or a clock change can't oversleep the target"""
+    remaining = (when - clock.now()).total_seconds()
+    while remaining > 0:
+        clock.sleep(min(60, remaining))
+        remaining = (when - clock.now()).total_seconds()
+
+def warm_up(client, scanner, clock):
+    """Everything a session start would otherwise wait on - today's login, instrument store and NSE cookies"""
+    while client.session_day != clock.now().date() and not client.login():
+        clock.sleep(60)
+    client._load_scrip_master()
+    import requests
+    try:
+        scanner.warm(force=True)
+    except requests.RequestException as e:
+        print(Fore.YELLOW + f"⚠️ NSE warm-up failed, the scan will retry: {e}")
+    client.new_session()
+
+def run_daemon(port=None):
+    """Long-lived mode - one process serves health and the dashboard and runs every trading day's session warm"""
+    started = time.perf_counter()
+    clock = SystemClock()
+    ws.start(port or int(os.getenv("PORT", Config.WS_PORT)))
+    ws.status.update({'mode': 'daemon', 'state': 'starting'})
+    
+    client = AngelClient(Config.API_KEY, Config.CLIENT_CODE, Config.MPIN, Config.TOTP_KEY)
+    scanner = NSEScanner()
+    warm_up(client, scanner, clock)
+    cold = (time.perf_counter() - started) * 1000
+    ws.status['cold_start_ms'] = round(cold)
+    print(Fore.GREEN + f"🔥 Daemon warm in {cold:,.0f}ms (login, instrument store, NSE session)")
+    
+    while True:
+        start = next_session(clock.now())
+        ws.status.update({'state': 'waiting', 'next_session': start.isoformat()})
+        print(Fore.CYAN + f"⏰ Next session {start.strftime('%a %Y-%m-%d %H:%M')} IST")
+        
+        # Re-warm just before the open - the JWT and the ScripMaster both roll over daily
+        if start > clock.now():
+            sleep_until(clock, start - timedelta(seconds=Config.DAEMON_WARMUP))
+            warm_up(client, scanner, clock)
+            sleep_until(clock, start)
+        
+        ws.status.update({'state': 'trading', 'session': clock.now().date().isoformat()})
+        try:
+            run_session(client, scanner)
+        except Exception as e:
+            print(Fore.RED + f"❌ Session error: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            log.flush()
+        
+        # Don't restart the same day's session once it has ended
+        sleep_until(clock, clock.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1))
+
 if __name__ == "__main__":
+    banner()
+    
+    if sys.argv[1:2] == ["backtest"]:
+        run_backtest_cli(sys.argv[2:])
+        sys.exit(0)
+    
+    if not all([Config.API_KEY, Config.CLIENT_CODE, Config.MPIN, Config.TOTP_KEY]):
+        print(Fore.RED + "❌ Missing credentials in .env file!")
+        sys.exit(1)
+    
+    if sys.argv[1:2] == ["daemon"]:
+        print(Fore.CYAN + f"🚀 Long Build Up Trader - {Config.MODE} MODE - daemon\n")
+        try:
+            run_daemon()
+        except KeyboardInterrupt:
+            print(Fore.YELLOW + "\n⚠️ Daemon stopped by user")
+        finally:
+            log.flush()
+        sys.exit(0)
+    
     print(Fore.CYAN + f"🚀 Long Build Up Trader - {Config.MODE} MODE\n")
     ws.start()
     
@@ -950,48 +3995,12 @@ if __name__ == "__main__":
         client = AngelClient(Config.API_KEY, Config.CLIENT_CODE, Config.MPIN, Config.TOTP_KEY)
         if not client.login():
             sys.exit(1)
-        
-        # Fetch Long Build Up stocks
-        buildup_stocks = fetch_long_buildup_from_nse()
-        asyncio.run(ws.broadcast({
-            'buildup_stocks': buildup_stocks,
-            'mode': Config.MODE,
-            'connected': True
-        }))
-        
-        if not buildup_stocks:
-            print(Fore.RED + "❌ No stocks to trade")
-            sys.exit(0)
-        
-        if not is_open():
-            print(Fore.RED + "❌ Market closed")
-            sys.exit(0)
-        
-        expiry = get_expiry()
-        print(Fore.CYAN + f"📅 Expiry: {expiry}\n")
-        
-        # Get ATM data for all stocks
-        watchlist = []
-        for s in buildup_stocks:
-            atm = get_atm(client, s['symbol'], expiry)
-            if atm:
-                watchlist.append(atm)
-        
-        if not watchlist:
-            print(Fore.RED + "❌ No options data available")
-            sys.exit(0)
-        
-        print(Fore.GREEN + f"\n✅ Watchlist ready with {len(watchlist)} stocks\n")
-        
-        # Start parallel monitoring
-        monitor = ParallelMonitor(client, watchlist)
-        monitor.start()
-        
-        # Show order book if live trading
-        if Config.MODE == "LIVE":
-            client.get_order_book()
+        run_session(client, NSEScanner())
     
     except Exception as e:
         print(Fore.RED + f"❌ Error: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+    
+    finally:
+        log.flush()
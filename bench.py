@@ -0,0 +1,350 @@
+"""
+Offline benchmarks for the tick hot path and instrument lookups.
+
+Everything runs against synthetic data (no broker, no network), so it can be run
+before market open to catch regressions:
+
+    python bench.py                      # run, compare against the stored baseline
+    python bench.py --save               # run and store the result as the new baseline
+    python bench.py --only process_tick  # run a subset (substring match)
+    python bench.py --imports            # where `import b` spends its startup milliseconds
+
+Each case reports per-op latency percentiles and the peak memory allocated per op
+(tracemalloc). A case regresses when its p50 is more than --threshold slower than
+the baseline; the exit code is 1 if anything regressed.
+"""
+import argparse, contextlib, io, json, os, platform, subprocess, sys, time, tracemalloc
+from datetime import datetime
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import b
+
+TARGET_SAMPLE_NS = 20000  # batch fast ops so each timed sample is at least ~20us
+DEFAULT_BASELINE = os.path.join(b.Config.DATA_DIR, "bench_baseline.json")
+
+# Measure what the tick loop pays to enqueue log records, not the pipeline thread rendering them
+b.log.console = False
+b.log.directory = None
+
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+def synthetic_master(n_stocks=180, expiries=("28OCT2026", "25NOV2026", "30DEC2026"), strikes=140):
+    """ScripMaster-shaped rows - 180 stocks x 3 expiries x 140 strikes is ~152k rows"""
+    rows, token = [], 10000
+    for i in range(n_stocks):
+        name = f"STK{i}"
+        rows.append({"token": str(token), "symbol": f"{name}-EQ", "name": name, "expiry": "", "strike": "-1.000000",
+                     "lotsize": "1", "instrumenttype": "", "exch_seg": "NSE"})
+        token += 1
+        for expiry in expiries:
+            tag = expiry[:5] + expiry[-2:]
+            rows.append({"token": str(token), "symbol": f"{name}{tag}FUT", "name": name, "expiry": expiry,
+                         "strike": "-1.000000", "lotsize": "500", "instrumenttype": "FUTSTK", "exch_seg": "NFO"})
+            token += 1
+            for k in range(strikes):
+                strike = 500 + k * 10
+                for opt in ("CE", "PE"):
+                    rows.append({"token": str(token), "symbol": f"{name}{tag}{strike}{opt}", "name": name,
+                                 "expiry": expiry, "strike": f"{strike * 100}.000000", "lotsize": "500",
+                                 "instrumenttype": "OPTSTK", "exch_seg": "NFO"})
+                    token += 1
+    return rows
+
+
+def make_monitor(n_instruments, open_trades=0, closed_trades=0):
+    """ParallelMonitor over a synthetic watchlist on a simulated clock, optionally with trades already taken"""
+    watchlist = b.synthetic_watchlist(max(1, n_instruments // 2), seed=7)
+    clock = b.SimClock(datetime(2026, 10, 16, 10, 0))
+    client = b.SimOrderClient({}, clock)
+    with contextlib.redirect_stdout(io.StringIO()):
+        monitor = b.ParallelMonitor(client, watchlist, clock=clock, publish=False, stream=False,
+                                    orders=b.OrderWorker(client, threaded=False))
+        stocks = [(stock, is_ce) for stock in watchlist for is_ce in (True, False)]
+        for n, (stock, is_ce) in enumerate(stocks[:open_trades + closed_trades]):
+            entry = (stock['ce_high'] if is_ce else stock['pe_high']) * 1.02
+            monitor.execute_breakout(stock, is_ce, entry)
+            if n >= open_trades:
+                name = f"{stock['symbol']}_{'CE' if is_ce else 'PE'}"
+                trade = monitor.trades[name]
+                monitor.execute_exit(trade, name, entry * 0.9, (entry * 0.1) * -trade['lot'], "Stop Loss")
+    return monitor
+
+
+def quiet_prices(monitor, instruments):
+    """Prices just under each breakout level / inside each stop band - a tick with nothing to do"""
+    prices = {}
+    for inst in instruments:
+        trade = monitor.trades.get(inst['key'])
+        prices[inst['key']] = trade['entry'] if trade else monitor.breakout_levels[inst['key']] * 0.99
+    return prices
+
+
+# ============================================================================
+# CASES
+# ============================================================================
+
+def case_get_all_instruments(n):
+    monitor = make_monitor(n)
+    return monitor.get_all_instruments
+
+
+def case_process_tick(n):
+    monitor = make_monitor(n)
+    instruments = monitor.get_all_instruments()
+    prices = quiet_prices(monitor, instruments)
+    return lambda: monitor.process_tick(instruments, prices)
+
+
+def case_process_tick_open(n):
+    monitor = make_monitor(n, open_trades=n)
+    instruments = monitor.get_all_instruments()
+    prices = quiet_prices(monitor, instruments)
+    return lambda: monitor.process_tick(instruments, prices)
+
+
+def case_update_websocket(n):
+    monitor = make_monitor(n, open_trades=n // 2, closed_trades=n // 2)
+    return monitor.update_websocket
+
+
+def case_dashboard_state(n):
+    # What update_websocket costs the monitor thread once a dashboard is connected
+    monitor = make_monitor(n, open_trades=n // 2, closed_trades=n // 2)
+    return monitor.dashboard_state
+
+
+def case_serialize_payload(n):
+    monitor = make_monitor(n, open_trades=n // 2, closed_trades=n // 2)
+    data = monitor.dashboard_state()
+    return lambda: json.dumps(data)
+
+
+class Lookups:
+    """One InstrumentStore built from the synthetic master, shared by the lookup cases"""
+    _store = None
+
+    @classmethod
+    def store(cls):
+        if cls._store is None:
+            store = b.InstrumentStore(None, None)
+            store._data = b.InstrumentStore.build(synthetic_master())
+            cls._store = store
+        return cls._store
+
+
+def case_lot_size(_):
+    store = Lookups.store()
+    names = [f"STK{i}" for i in range(0, 180, 7)]
+    return lambda: [store.lot_size(name) for name in names]
+
+
+def case_atm(_):
+    store = Lookups.store()
+    names = [f"STK{i}" for i in range(0, 180, 7)]
+    return lambda: [store.atm(name, "25NOV2026", 1234.5) for name in names]
+
+
+def case_equity_token(_):
+    store = Lookups.store()
+    names = [f"STK{i}" for i in range(0, 180, 7)]
+    return lambda: [store.equity(name) for name in names]
+
+
+CANDLES = [[f"2026-10-16T{9 + m // 60:02d}:{m % 60:02d}:00+05:30", 40.5, 45.25, 39.0, 44.1, 1200]
+           for m in range(15, 375, 3)]
+
+
+def case_parse_timestamp(_):
+    parse = b.AngelClient._parse_timestamp
+    stamps = [c[0] for c in CANDLES]
+    return lambda: [parse(ts) for ts in stamps]
+
+
+def case_parse_candle(_):
+    client = b.AngelClient.__new__(b.AngelClient)
+    return lambda: [client._parse_candle(c) for c in CANDLES]
+
+
+def case_candle_cache_parse(_):
+    return lambda: b.CandleCache.parse(CANDLES)
+
+
+CASES = [
+    ("get_all_instruments", case_get_all_instruments, (4, 100, 1000)),
+    ("process_tick", case_process_tick, (4, 100, 1000)),
+    ("process_tick_open", case_process_tick_open, (4, 100, 1000)),
+    ("update_websocket", case_update_websocket, (300,)),
+    ("dashboard_state", case_dashboard_state, (300,)),
+    ("serialize_payload", case_serialize_payload, (300,)),
+    ("lot_size x26", case_lot_size, (None,)),
+    ("atm x26", case_atm, (None,)),
+    ("equity_token x26", case_equity_token, (None,)),
+    ("parse_timestamp x120", case_parse_timestamp, (None,)),
+    ("parse_candle x120", case_parse_candle, (None,)),
+    ("candle_cache_parse x120", case_candle_cache_parse, (None,)),
+]
+
+
+# ============================================================================
+# IMPORT PROFILE
+# ============================================================================
+
+# Imported by b.py on first use - the profile reports what each one adds when it is finally needed
+DEFERRED = ("requests", "pandas", "SmartApi", "pyotp", "fastapi", "uvicorn", "websocket", "aiohttp")
+
+
+def import_profile(module="b", deferred=DEFERRED):
+    """`python -X importtime` in a fresh interpreter - returns (total ms, {direct import: ms}, {deferred: ms})"""
+    code = f"import {module}\n" + "".join(f"try:\n    import {name}\nexcept ImportError:\n    pass\n" for name in deferred)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    total, direct, late, children = None, {}, {}, []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        name, ms = parts[2].strip(), int(parts[1]) / 1000
+        if depth == 1:
+            children.append((name, ms))
+        elif depth == 0:
+            if name == module:
+                total, direct = ms, dict(children)
+            elif total is not None and name in deferred:
+                late[name] = ms  # only what is left to load once `module` is already in
+            children = []
+    if total is None:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return total, direct, late
+
+
+def print_import_profile(top=12):
+    total, direct, late = import_profile()
+    print(f"⏱️ import b: {total:,.1f}ms\n")
+    for name, ms in sorted(direct.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:<24} {ms:>8.1f}ms  {ms / total:>6.1%}")
+    print("\n💤 Deferred to first use:\n")
+    for name in DEFERRED:
+        print(f"  {name:<24} {late[name]:>8.1f}ms" if name in late else f"  {name:<24} {'not installed':>10}")
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def measure(op, samples, sink):
+    """Time `op` - returns per-op latency percentiles (us) and peak bytes allocated per op"""
+    with contextlib.redirect_stdout(sink):
+        op()  # warm up
+        started = time.perf_counter_ns()
+        op()
+        inner = max(1, TARGET_SAMPLE_NS // max(1, time.perf_counter_ns() - started))
+
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter_ns()
+            for _ in range(inner):
+                op()
+            timings.append((time.perf_counter_ns() - started) / inner / 1000)
+
+        tracemalloc.start()
+        peaks = []
+        for _ in range(min(samples, 20)):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            op()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "p50": percentile(timings, 0.50),
+        "p90": percentile(timings, 0.90),
+        "p99": percentile(timings, 0.99),
+        "alloc_kb": sorted(peaks)[len(peaks) // 2] / 1024,
+        "samples": samples,
+        "inner": inner
+    }
+
+
+def run(selected, samples):
+    results = {}
+    with open(os.devnull, "w") as sink:
+        for name, factory, sizes in CASES:
+            for n in sizes:
+                label = name if n is None else f"{name}[{n}]"
+                if selected and not any(s in label for s in selected):
+                    continue
+                with contextlib.redirect_stdout(sink):
+                    op = factory(n)
+                results[label] = measure(op, samples, sink)
+                print(format_row(label, results[label]), flush=True)
+    return results
+
+
+def format_row(label, r, base=None, threshold=None):
+    row = f"{label:<28} p50 {r['p50']:>10.1f}us  p90 {r['p90']:>10.1f}us  p99 {r['p99']:>10.1f}us  alloc {r['alloc_kb']:>9.1f}KB"
+    if base:
+        change = r['p50'] / base['p50'] - 1
+        flag = "  ❌ REGRESSION" if change > threshold else ""
+        row += f"  vs baseline {change:+7.1%}{flag}"
+    return row
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'='*70}\n📊 vs baseline from {baseline.get('created', '?')} ({baseline.get('machine', '?')})\n{'='*70}")
+    for label, r in results.items():
+        base = baseline["results"].get(label)
+        if not base:
+            print(format_row(label, r) + "  (new)")
+            continue
+        print(format_row(label, r, base, threshold))
+        if r['p50'] / base['p50'] - 1 > threshold:
+            regressions.append(label)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the tick hot path and instrument lookups")
+    parser.add_argument("--samples", type=int, default=200, help="Timed samples per case")
+    parser.add_argument("--only", nargs="*", help="Only run cases whose label contains one of these")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed p50 slowdown before flagging")
+    parser.add_argument("--imports", action="store_true", help="Profile the startup cost of `import b` instead")
+    args = parser.parse_args()
+
+    if args.imports:
+        print_import_profile()
+        sys.exit(0)
+
+    print(f"⏱️ Benchmarks - {args.samples} samples per case\n")
+    results = run(args.only, args.samples)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "machine": platform.node(),
+                       "python": platform.python_version(), "results": results}, f, indent=2)
+        print(f"\n✅ Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️ No baseline at {args.baseline} - run with --save to create one")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ No regressions")
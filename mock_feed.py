@@ -0,0 +1,115 @@
+"""
+Local stand-in for the SmartAPI WebSocket V2 market feed.
+
+Speaks the same protocol as smartapisocket.angelone.in/smart-stream in LTP mode
+(JSON subscribe/unsubscribe requests in, 51-byte little-endian binary packets out,
+"ping" -> "pong" heartbeat) so b.py can be run with FEED_MODE=STREAM without a
+broker connection:
+
+    python mock_feed.py --port 8765                      # random walk for every subscribed token
+    python mock_feed.py --replay ticks.csv --speed 60    # replay recorded ticks (timestamp,token,ltp)
+
+    FEED_MODE=STREAM FEED_URL=ws://127.0.0.1:8765/smart-stream python b.py
+"""
+import argparse, asyncio, csv, json, random, struct, time
+from datetime import datetime
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import uvicorn
+
+PACKET = struct.Struct('<BB25sqqq')
+LTP_MODE = 1
+
+
+def pack_ltp(exchange_type, token, ltp, seq, ts=None):
+    """Build one LTP-mode feed packet (price in paise, timestamp in ms)"""
+    ts_ms = int((ts or time.time()) * 1000)
+    return PACKET.pack(LTP_MODE, exchange_type, str(token).encode(), seq, ts_ms, int(round(ltp * 100)))
+
+
+def load_replay(path):
+    """Load `timestamp,token,ltp` rows (epoch seconds or ISO timestamps) sorted by time"""
+    rows = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            ts = row['timestamp']
+            try:
+                ts = float(ts)
+            except ValueError:
+                ts = datetime.fromisoformat(ts).timestamp()
+            rows.append((ts, str(row['token']), float(row['ltp'])))
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def create_app(replay=None, speed=1.0, interval=0.5, seed=None):
+    app = FastAPI()
+
+    @app.websocket("/smart-stream")
+    async def stream(ws: WebSocket):
+        await ws.accept()
+        subscribed = {}  # token -> exchange type
+        rng = random.Random(seed)
+
+        async def receiver():
+            while True:
+                message = await ws.receive_text()
+                if message == "ping":
+                    await ws.send_text("pong")
+                    continue
+                request = json.loads(message)
+                for entry in request.get('params', {}).get('tokenList', []):
+                    for token in entry.get('tokens', []):
+                        if request.get('action') == 1:
+                            subscribed[str(token)] = entry['exchangeType']
+                        else:
+                            subscribed.pop(str(token), None)
+
+        async def random_walk():
+            prices, seq = {}, 0
+            while True:
+                await asyncio.sleep(interval)
+                for token, etype in list(subscribed.items()):
+                    last = prices.get(token, rng.uniform(50, 300))
+                    prices[token] = max(0.05, round(last * (1 + rng.gauss(0, 0.004)), 2))
+                    seq += 1
+                    await ws.send_bytes(pack_ltp(etype, token, prices[token], seq))
+
+        async def replayer():
+            while not subscribed:
+                await asyncio.sleep(0.05)
+            start_wall, start_ts = time.time(), replay[0][0]
+            for seq, (ts, token, ltp) in enumerate(replay, 1):
+                delay = (ts - start_ts) / speed - (time.time() - start_wall)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if token in subscribed:
+                    await ws.send_bytes(pack_ltp(subscribed[token], token, ltp, seq, ts))
+
+        tasks = [asyncio.create_task(receiver()),
+                 asyncio.create_task(replayer() if replay else random_walk())]
+        try:
+            await asyncio.gather(*tasks)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock SmartAPI WebSocket V2 feed server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--replay", help="CSV of timestamp,token,ltp rows to replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument("--interval", type=float, default=0.5, help="Random-walk update interval (seconds)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    replay = load_replay(args.replay) if args.replay else None
+    print(f"📡 Mock feed on ws://{args.host}:{args.port}/smart-stream "
+          f"({'replay ' + str(len(replay)) + ' ticks' if replay else 'random walk'})")
+    uvicorn.run(create_app(replay, args.speed, args.interval, args.seed),
+                host=args.host, port=args.port, log_level="error")